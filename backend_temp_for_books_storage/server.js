@@ -62,13 +62,6 @@ app.get("/books", (req, res) => {
 
 const APPEND = true; // ✅ Set to true to append, false to overwrite (toggle for debugging)
 
-// Generate unique IDs for new nodes
-const generateId = (index) => {
-    const chars = "abcdefghijklmnopqrstuvwxyz";
-    if (index < 26) return chars[index];
-    return chars[Math.floor(index / 26) - 1] + chars[index % 26];
-};
-
 // store book data
 app.post("/books", (req, res) => {
     try {
@@ -81,28 +74,30 @@ app.post("/books", (req, res) => {
         if (APPEND) {
             const existingData = readData();
             const existingNodes = existingData.nodes || [];
-            const nodeOffset = existingNodes.length;
-
-            // Old ID -> New ID
-            const idMap = {}; 
-
-            // 1. Rename the `id` and `text` fields in nodes
-            const newNodes = nodes.map((node, idx) => {
-                const newId = generateId(nodeOffset + idx);
-                idMap[node.id] = newId;
-                return {
-                    ...node,
-                    id: newId,
-                    text: newId
-                };
+
+            // Node IDs are Gutenberg IDs, so they stay stable across additions.
+            // Gutenberg ID -> ID of the node already stored for that book
+            const idMap = {};
+            existingNodes.forEach(node => {
+                idMap[String(node.data?.gutindex_id ?? node.id)] = node.id;
+            });
+
+            // 1. Keep only nodes for books that aren't stored yet
+            const newNodes = nodes.filter(node => {
+                const key = String(node.data?.gutindex_id ?? node.id);
+                if (key in idMap) return false;
+                idMap[key] = node.id;
+                return true;
             });
 
-            // 2. Replace 'from' and 'to' in lines
-            const newLines = lines.map(line => ({
-                from: idMap[line.from],
-                to: idMap[line.to],
-                reason: line.reason
-            }));
+            // 2. Point lines at the stored nodes (expansions also link to existing books)
+            const newLines = lines
+                .map(line => ({
+                    ...line,
+                    from: idMap[line.from] ?? line.from,
+                    to: idMap[line.to] ?? line.to
+                }))
+                .filter(line => line.from !== line.to);
 
             const mergedData = {
                 lines: [...(existingData.lines || []), ...newLines],
@@ -111,7 +106,7 @@ app.post("/books", (req, res) => {
             };
 
             writeData(mergedData);
-            res.json({ message: "Book data appended with remapped IDs successfully" });
+            res.json({ message: "Book data appended successfully" });
         } else {
             writeData({ lines, nodes, rootId });
             res.json({ message: "Book data successfully stored" });
@@ -1,23 +1,457 @@
 import os
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIError, OpenAI
 import requests
-import string
-from urllib.parse import parse_qsl
+import json
+import math
+import bisect
+import heapq
+import zipfile
+import itertools
+import time
+import logging
+import contextvars
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from cache import LRUCache, ResponseCache, normalize_query_params
+from book_index import BookIndexStore, context_message
+from catalog import Catalog
+from cover_images import CoverStore, cover_etag, etag_matches
+from conversation import SummaryCache, build_summary_messages, split_conversation, summary_message
+from query_parser import FastPathTranslator, parse_simple_query
+from query_translation import TranslationCache, build_translation_messages, normalize_user_text, parse_query_string
+from response_encoding import encode_payload, slim_payload
+from route_classifier import RouteClassifier, build_route_messages, parse_route
+from similarity import BookVectors, shared_top_terms, top_k_pairs
+from singleflight import SingleFlight
+from upstream import CircuitOpenError, Upstream, UpstreamError, UpstreamTimeout
+from metrics import REGISTRY, SlowRequestLog, current_request, stage_timer, start_request
 
 # Load environment variables from the .env file
 load_dotenv()
 
 app = Flask(__name__)
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger("gutget")
+
 # Retrieve API keys from environment variables
 REQUIRED_API_KEY = os.getenv("REQUIRED_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-GUTENDEX_URL = "https://gutendex.com/books"
+GUTENDEX_URL = os.getenv("GUTENDEX_URL", "https://gutendex.com/books")
+
+# Gutendex response cache settings. Set GUTENDEX_CACHE_DIR to share cached pages
+# between gunicorn workers on the same host.
+GUTENDEX_CACHE_SIZE = int(os.getenv("GUTENDEX_CACHE_SIZE", "512"))
+GUTENDEX_CACHE_TTL = float(os.getenv("GUTENDEX_CACHE_TTL", "3600"))
+GUTENDEX_CACHE_DIR = os.getenv("GUTENDEX_CACHE_DIR")
+GUTENDEX_CACHE_DISK_SIZE = int(os.getenv("GUTENDEX_CACHE_DISK_SIZE", "10000"))
+# Expired pages are still served for GUTENDEX_STALE_TTL seconds while they are refreshed
+# in the background.
+GUTENDEX_STALE_TTL = float(os.getenv("GUTENDEX_STALE_TTL", "86400"))
+
+# Upstream call settings. Gutendex and translation calls time out after a multiple of
+# their recent p99 latency, clamped to the MIN/MAX timeouts, and are hedged with a second
+# request after their p95 latency (OpenAI hedging costs tokens, so it is off by default).
+# After UPSTREAM_FAILURE_THRESHOLD consecutive failures an upstream is skipped for
+# UPSTREAM_RESET_TIMEOUT seconds. Chat and summary completions are longer, so they get
+# their own timeouts (OPENAI_CHAT_TIMEOUT_MIN up to OPENAI_TIMEOUT) but share the OpenAI
+# circuit breaker. The client doesn't retry on its own.
+GUTENDEX_TIMEOUT_MIN = float(os.getenv("GUTENDEX_TIMEOUT_MIN", "1"))
+GUTENDEX_TIMEOUT_MAX = float(os.getenv("GUTENDEX_TIMEOUT_MAX", "15"))
+GUTENDEX_HEDGE = os.getenv("GUTENDEX_HEDGE", "1").lower() in ("1", "true", "yes")
+OPENAI_TIMEOUT_MIN = float(os.getenv("OPENAI_TIMEOUT_MIN", "3"))
+OPENAI_TIMEOUT_MAX = float(os.getenv("OPENAI_TIMEOUT_MAX", "30"))
+OPENAI_HEDGE = os.getenv("OPENAI_HEDGE", "0").lower() in ("1", "true", "yes")
+OPENAI_CHAT_TIMEOUT_MIN = float(os.getenv("OPENAI_CHAT_TIMEOUT_MIN", "10"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5"))
+UPSTREAM_RESET_TIMEOUT = float(os.getenv("UPSTREAM_RESET_TIMEOUT", "30"))
+
+# Set CATALOG_DB to answer Gutendex queries from a local catalog built with catalog.py
+# instead of calling gutendex.com.
+CATALOG_DB = os.getenv("CATALOG_DB")
+
+# Number of later Gutendex pages fetched ahead concurrently when one page isn't enough.
+GUTENDEX_PREFETCH_PAGES = int(os.getenv("GUTENDEX_PREFETCH_PAGES", "4"))
+
+# Largest n a graph query may ask for, which bounds the Gutendex pages it can walk.
+MAX_BOOKS = int(os.getenv("MAX_BOOKS", "200"))
+
+# Slow-request log settings.
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "2.0"))
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv("SLOW_REQUEST_SAMPLE_RATE", "0.1"))
+
+# Maximum number of edges kept per node in the book graph.
+GRAPH_MAX_DEGREE = int(os.getenv("GRAPH_MAX_DEGREE", "8"))
+
+# /chat compaction: conversations over CHAT_TOKEN_BUDGET estimated tokens (0 disables it)
+# have their older turns folded into a summary, CHAT_FOLD_BLOCK turns at a time, keeping
+# at least the last CHAT_KEEP_RECENT turns verbatim.
+CHAT_TOKEN_BUDGET = int(os.getenv("CHAT_TOKEN_BUDGET", "6000"))
+CHAT_KEEP_RECENT = int(os.getenv("CHAT_KEEP_RECENT", "6"))
+CHAT_FOLD_BLOCK = int(os.getenv("CHAT_FOLD_BLOCK", "8"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "400"))
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+CHAT_SUMMARY_CACHE_SIZE = int(os.getenv("CHAT_SUMMARY_CACHE_SIZE", "1024"))
+
+# /context_chat retrieval: per-book passage indexes are kept in BOOK_INDEX_DIR. Book files
+# are downloaded from their book_download URL, or read from BOOK_SOURCE_DIR (files named
+# <id>.zip, <id>.txt or <id>.html) when it is set, e.g. for tests or a local mirror.
+BOOK_INDEX_DIR = os.getenv("BOOK_INDEX_DIR", "book_index")
+BOOK_SOURCE_DIR = os.getenv("BOOK_SOURCE_DIR")
+BOOK_DOWNLOAD_TIMEOUT = float(os.getenv("BOOK_DOWNLOAD_TIMEOUT", "60"))
+# Largest book download, and largest decompressed text, that is indexed.
+BOOK_MAX_BYTES = int(os.getenv("BOOK_MAX_BYTES", str(64 * 1024 * 1024)))
+CONTEXT_TOP_K = int(os.getenv("CONTEXT_TOP_K", "6"))
+# Most books a /context_chat request may select in gutindex_ids.
+CONTEXT_MAX_BOOKS = int(os.getenv("CONTEXT_MAX_BOOKS", "20"))
+
+# Cover image proxy: covers are downloaded once and resized to COVER_WIDTHS thumbnails,
+# kept in COVER_CACHE_DIR up to COVER_CACHE_MAX_BYTES. Graph requests with "thumbnails"
+# get pic URLs for COVER_THUMBNAIL_WIDTH thumbnails under COVER_BASE_URL (by default the
+# URL the request came in on; behind a reverse proxy set TRUSTED_PROXY_HOPS, or
+# COVER_BASE_URL, so it is the public one).
+COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR", "cover_cache")
+COVER_CACHE_MAX_BYTES = int(os.getenv("COVER_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+COVER_WIDTHS = tuple(int(width) for width in os.getenv("COVER_WIDTHS", "64,128,256").split(","))
+COVER_THUMBNAIL_WIDTH = int(os.getenv("COVER_THUMBNAIL_WIDTH", "128"))
+COVER_DOWNLOAD_TIMEOUT = float(os.getenv("COVER_DOWNLOAD_TIMEOUT", "10"))
+COVER_MAX_AGE = int(os.getenv("COVER_MAX_AGE", str(30 * 86400)))
+COVER_BASE_URL = os.getenv("COVER_BASE_URL")
+
+# Number of reverse proxies in front of the app whose X-Forwarded-For/-Proto/-Host/-Prefix
+# headers are trusted, so request URLs carry the public scheme and host. 0 trusts none.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+# /classify_route: a local classifier trained from ROUTE_EXAMPLES_FILE picks the route.
+# With ROUTE_LLM_FALLBACK=1, predictions below ROUTE_CONFIDENCE_THRESHOLD are re-checked
+# by ROUTE_LLM_MODEL.
+ROUTE_EXAMPLES_FILE = os.getenv(
+    "ROUTE_EXAMPLES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "route_examples.jsonl")
+)
+ROUTE_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTE_CONFIDENCE_THRESHOLD", "0.75"))
+ROUTE_LLM_FALLBACK = os.getenv("ROUTE_LLM_FALLBACK", "0").lower() in ("1", "true", "yes")
+ROUTE_LLM_MODEL = os.getenv("ROUTE_LLM_MODEL", "gpt-4o-mini")
+
+# Number of tidy books remembered by Gutenberg ID, so graph expansions can link new books
+# to the existing ones without fetching them again.
+KNOWN_BOOKS_SIZE = int(os.getenv("KNOWN_BOOKS_SIZE", "10000"))
+
+# Most Gutenberg IDs a graph expansion may list in existing_ids.
+EXPAND_MAX_IDS = int(os.getenv("EXPAND_MAX_IDS", "500"))
+
+# Batch graph settings: at most BATCH_MAX_QUERIES queries per request, of which
+# BATCH_MAX_CONCURRENCY are translated and fetched at the same time.
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "50"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+
+# Most Gutenberg IDs whose summaries /book_summaries returns per request.
+SUMMARIES_MAX_IDS = int(os.getenv("SUMMARIES_MAX_IDS", "100"))
+
+# How graph edges are chosen: "attributes" links books that share an author, subject or
+# bookshelf, and "similarity" links each book to its most similar books by TF-IDF over
+# subjects, bookshelves and summary, when the similarity is at least SIMILARITY_MIN_SCORE.
+# Requests pick one with "edges"; GRAPH_EDGE_MODE is the default.
+EDGE_MODES = ("attributes", "similarity")
+GRAPH_EDGE_MODE = os.getenv("GRAPH_EDGE_MODE", "attributes")
+SIMILARITY_MIN_SCORE = float(os.getenv("SIMILARITY_MIN_SCORE", "0.1"))
+BOOK_VECTOR_CACHE_SIZE = int(os.getenv("BOOK_VECTOR_CACHE_SIZE", "50000"))
+SIMILARITY_MAX_TERMS = int(os.getenv("SIMILARITY_MAX_TERMS", "500000"))
+
+# Edge weight and reason for each kind of attribute two books can share.
+EDGE_WEIGHTS = {"author": 3.0, "bookshelf": 1.0, "subject": 1.0}
+EDGE_REASONS = {
+    "author": "These books were written by the same author, {}.",
+    "bookshelf": "These books are both on the {} bookshelf.",
+    "subject": "These books share the subject {}.",
+    "similarity": "These books have similar subjects and summaries ({})."
+}
+
+# Translation cache settings. TRANSLATION_SEED_FILE may point to a JSON object mapping
+# user queries to Gutendex query strings (or parameter dicts) to pre-seed the cache.
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "2048"))
+TRANSLATION_CACHE_TTL = float(os.getenv("TRANSLATION_CACHE_TTL", "86400"))
+TRANSLATION_SEED_FILE = os.getenv("TRANSLATION_SEED_FILE")
+
+# Simple requests ("french poetry", "books by Jane Austen") are translated locally when
+# the rule-based parser is at least FAST_PATH_THRESHOLD confident. Above 1 disables it.
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.8"))
+
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS,
+        x_host=TRUSTED_PROXY_HOPS, x_prefix=TRUSTED_PROXY_HOPS
+    )
 
 # Initialize the OpenAI client using the new library format.
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT, max_retries=0)
+
+gutendex_cache = ResponseCache(
+    maxsize=GUTENDEX_CACHE_SIZE,
+    ttl=GUTENDEX_CACHE_TTL,
+    directory=GUTENDEX_CACHE_DIR,
+    disk_max_entries=GUTENDEX_CACHE_DISK_SIZE,
+    stale_ttl=GUTENDEX_STALE_TTL
+)
+
+gutendex_upstream = Upstream(
+    "gutendex",
+    min_timeout=GUTENDEX_TIMEOUT_MIN,
+    max_timeout=GUTENDEX_TIMEOUT_MAX,
+    hedge=GUTENDEX_HEDGE,
+    failure_threshold=UPSTREAM_FAILURE_THRESHOLD,
+    reset_timeout=UPSTREAM_RESET_TIMEOUT
+)
+openai_upstream = Upstream(
+    "openai",
+    min_timeout=OPENAI_TIMEOUT_MIN,
+    max_timeout=OPENAI_TIMEOUT_MAX,
+    hedge=OPENAI_HEDGE,
+    failure_threshold=UPSTREAM_FAILURE_THRESHOLD,
+    reset_timeout=UPSTREAM_RESET_TIMEOUT
+)
+openai_chat_upstream = Upstream(
+    "openai_chat",
+    min_timeout=OPENAI_CHAT_TIMEOUT_MIN,
+    max_timeout=OPENAI_TIMEOUT,
+    hedge=False,
+    breaker=openai_upstream.breaker
+)
+
+local_catalog = Catalog(CATALOG_DB) if CATALOG_DB else None
+
+known_books = LRUCache(maxsize=KNOWN_BOOKS_SIZE, ttl=GUTENDEX_CACHE_TTL)
+
+# Term counts of each book for similarity edges, by Gutenberg ID.
+book_vectors = BookVectors(maxsize=BOOK_VECTOR_CACHE_SIZE, max_terms=SIMILARITY_MAX_TERMS)
+
+# Reuse one keep-alive connection pool for all Gutendex requests.
+gutendex_session = requests.Session()
+# Shared worker pool for prefetching later pages of a result set.
+gutendex_executor = ThreadPoolExecutor(max_workers=max(GUTENDEX_PREFETCH_PAGES, 1) * 4)
+# Worker pool for refreshing stale Gutendex pages in the background.
+revalidate_executor = ThreadPoolExecutor(max_workers=4)
+# Worker pool for the queries of batch graph requests.
+batch_executor = ThreadPoolExecutor(max_workers=max(BATCH_MAX_CONCURRENCY, 1))
+
+book_indexes = BookIndexStore(
+    BOOK_INDEX_DIR,
+    source_dir=BOOK_SOURCE_DIR,
+    session=gutendex_session,
+    timeout=BOOK_DOWNLOAD_TIMEOUT,
+    max_bytes=BOOK_MAX_BYTES
+)
+# Worker pool for downloading and indexing the books of /context_chat requests.
+book_index_executor = ThreadPoolExecutor(max_workers=4)
+
+cover_store = CoverStore(
+    COVER_CACHE_DIR,
+    max_bytes=COVER_CACHE_MAX_BYTES,
+    session=gutendex_session,
+    timeout=COVER_DOWNLOAD_TIMEOUT
+)
+
+# Requests slower than SLOW_REQUEST_SECONDS have their stage timings logged, for a
+# SLOW_REQUEST_SAMPLE_RATE fraction of them.
+slow_request_log = SlowRequestLog(SLOW_REQUEST_SECONDS, SLOW_REQUEST_SAMPLE_RATE)
+
+# Coalesce identical translations and Gutendex fetches that are in flight at the same time.
+translation_flight = SingleFlight()
+gutendex_flight = SingleFlight()
+
+summary_cache = SummaryCache(fold_block=max(CHAT_FOLD_BLOCK, 1), maxsize=CHAT_SUMMARY_CACHE_SIZE)
+
+translation_cache = TranslationCache(maxsize=TRANSLATION_CACHE_SIZE, ttl=TRANSLATION_CACHE_TTL)
+if TRANSLATION_SEED_FILE:
+    with open(TRANSLATION_SEED_FILE, "r", encoding="utf-8") as f:
+        translation_cache.seed(json.load(f))
+
+fast_path = FastPathTranslator(threshold=FAST_PATH_THRESHOLD)
+
+route_classifier = RouteClassifier.from_file(ROUTE_EXAMPLES_FILE)
+
+
+def cache_metrics(flights=None):
+    """
+    Publishes the cache and coalescing counters at /metrics. flights maps upstream names to
+    the single-flight groups to report, this app's own by default.
+    """
+    gutendex = gutendex_cache.stats()
+    caches = {
+        "gutendex_memory": gutendex["memory"],
+        "translation": translation_cache.stats(),
+        "chat_summary": summary_cache.stats(),
+        "book_vectors": book_vectors.stats(),
+        "cover_images": cover_store.stats()
+    }
+    if gutendex["disk"] is not None:
+        caches["gutendex_disk"] = gutendex["disk"]
+    if flights is None:
+        flights = {"gutendex": gutendex_flight, "translation": translation_flight}
+    flights = {name: flight.stats() for name, flight in flights.items()}
+    return [
+        ("gutget_cache_hits_total", "counter", "Cache hits.",
+         [({"cache": name}, stats["hits"]) for name, stats in caches.items()]),
+        ("gutget_cache_misses_total", "counter", "Cache misses.",
+         [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+        ("gutget_upstream_calls_total", "counter", "Upstream calls made after coalescing.",
+         [({"upstream": name}, stats["executed"]) for name, stats in flights.items()]),
+        ("gutget_coalesced_requests_total", "counter", "Requests that waited on an identical in-flight call.",
+         [({"upstream": name}, stats["coalesced"]) for name, stats in flights.items()]),
+        ("gutget_fast_path_queries_total", "counter", "Queries the rule-based parser did or didn't answer without the LLM.",
+         [({"outcome": "hit"}, fast_path.hits), ({"outcome": "miss"}, fast_path.misses)])
+    ]
+
+
+def upstream_metrics():
+    """
+    Publishes the upstream call layer's counters, timeouts and circuit states at /metrics.
+    """
+    upstreams = {
+        "gutendex": gutendex_upstream.stats(),
+        "openai": openai_upstream.stats(),
+        "openai_chat": openai_chat_upstream.stats()
+    }
+    return [
+        ("gutget_upstream_hedged_requests_total", "counter", "Hedged duplicate requests sent.",
+         [({"upstream": name}, stats["hedges"]) for name, stats in upstreams.items()]),
+        ("gutget_upstream_timeouts_total", "counter", "Calls that hit their adaptive timeout.",
+         [({"upstream": name}, stats["timeouts"]) for name, stats in upstreams.items()]),
+        ("gutget_upstream_rejected_total", "counter", "Calls refused while the circuit breaker was open.",
+         [({"upstream": name}, stats["rejected"]) for name, stats in upstreams.items()]),
+        ("gutget_upstream_timeout_seconds", "gauge", "Current adaptive timeout.",
+         [({"upstream": name}, stats["timeout"]) for name, stats in upstreams.items()]),
+        ("gutget_upstream_circuit_open", "gauge", "1 while the circuit breaker is open or half-open.",
+         [({"upstream": name}, int(stats["state"] != "closed")) for name, stats in upstreams.items()]),
+        ("gutget_stale_responses_total", "counter", "Expired Gutendex pages served while being refreshed.",
+         [({"cache": "gutendex_memory"}, gutendex_cache.memory.stale_hits)]
+         + ([({"cache": "gutendex_disk"}, gutendex_cache.disk.stale_hits)] if gutendex_cache.disk is not None else []))
+    ]
+
+
+REGISTRY.add_collector(cache_metrics)
+REGISTRY.add_collector(upstream_metrics)
+
+
+def translate_query(user_query):
+    """
+    Uses the OpenAI client to translate a natural-language query into a dictionary of
+    Gutendex query parameters. Repeated and near-identical queries are answered from the
+    translation cache without calling the model, simple ones by the rule-based fast path,
+    and identical queries arriving while a translation is in flight wait for that one call.
+    """
+    query_params = translation_cache.get(user_query)
+    if query_params is not None:
+        return query_params
+    with stage_timer("fast_path"):
+        query_params = fast_path.translate(user_query)
+    if query_params is not None:
+        return query_params
+    try:
+        query_params = translation_flight.do(normalize_user_text(user_query), _translate_query_uncached, user_query)
+    except (UpstreamError, APIError) as e:
+        logger.warning("Query translation failed, falling back to the rule-based parse: %s", e)
+        return fallback_query_params(user_query)
+    return dict(query_params)
+
+
+def fallback_query_params(user_query):
+    """
+    Query parameters used when the LLM translation is unavailable: the rule-based parse,
+    however unsure it is, or else a full-text search for the request.
+    """
+    query_params, _ = parse_simple_query(user_query)
+    return query_params or {"search": normalize_user_text(user_query), "languages": "en"}
+
+
+def _translate_query_uncached(user_query):
+    with stage_timer("llm_translation"):
+        response = openai_upstream.call(_complete_translation, user_query)
+    parsed_query = response.choices[0].message.content
+    logger.debug("Parsed query: %s", parsed_query)
+    with stage_timer("query_postprocess"):
+        query_params = parse_query_string(parsed_query)
+    translation_cache.set(user_query, query_params)
+    return query_params
+
+
+def _complete_translation(timeout, user_query):
+    # Hedging and the deadline replace the client's own retries.
+    return client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+        model="gpt-4o",
+        messages=build_translation_messages(user_query),
+        response_format={"type": "text"},
+        temperature=0.5,
+        max_completion_tokens=2048,
+        top_p=1,
+        frequency_penalty=0,
+        presence_penalty=0
+    )
+
+
+def fetch_gutendex(query_params):
+    """
+    Returns the decoded Gutendex response for a dictionary of query parameters. Repeated
+    queries are served from the response cache instead of going back to gutendex.com, and
+    identical queries arriving while a request is in flight share its response. An
+    expired response is served as is while a background request refreshes it.
+    When a local catalog is configured it answers the query directly.
+    """
+    with stage_timer("gutendex_fetch"):
+        if local_catalog is not None:
+            return local_catalog.query(query_params)
+        data = gutendex_cache.get(query_params)
+        if data is not None:
+            return data
+        key = normalize_query_params(query_params)
+        data = gutendex_cache.get_stale(query_params)
+        if data is not None:
+            revalidate_executor.submit(_revalidate_gutendex, key, query_params)
+            return data
+        return gutendex_flight.do(key, _fetch_gutendex_uncached, query_params)
+
+
+def _revalidate_gutendex(key, query_params):
+    try:
+        gutendex_flight.do(key, _fetch_gutendex_uncached, query_params)
+    except Exception as e:
+        logger.warning("Refreshing stale Gutendex page %s failed: %s", key, e)
+
+
+def _fetch_gutendex_uncached(query_params):
+    data = gutendex_upstream.call(_get_gutendex, query_params)
+    gutendex_cache.set(query_params, data)
+    return data
+
+
+def _get_gutendex(timeout, query_params):
+    response = gutendex_session.get(GUTENDEX_URL, params=query_params, timeout=timeout)
+    response.raise_for_status()  # Raise an error for bad responses (4xx, 5xx)
+    return response.json()
+
+
+def wants_slim(data, args):
+    """
+    Returns True when the client asked for the slim projection, which leaves out book
+    summaries, with "fields": "slim" in the body or ?fields=slim.
+    """
+    return data.get("fields") == "slim" or args.get("fields") == "slim"
+
+
+def payload_response(payload, slim=False):
+    """
+    Serializes payload as JSON or MessagePack, compressed with brotli or gzip, according
+    to the request's Accept and Accept-Encoding headers.
+    """
+    with stage_timer("serialize"):
+        if slim:
+            payload = slim_payload(payload)
+        body, headers = encode_payload(payload, request.headers.get("Accept"), request.headers.get("Accept-Encoding"))
+    return Response(body, status=200, headers=headers)
+
 
 @app.route("/query_books", methods=["POST"])
 def query_books():
@@ -30,134 +464,23 @@ def query_books():
         abort(401, description="Unauthorized: Invalid or missing API key")
     
     user_query = data["query"]
+    slim = wants_slim(data, request.args)
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-                "role": "system",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": (
-                            "You are a helpful librarian assistant that is designed to assist users with finding, "
-                            "discovering and exploring books on Project Gutenberg by making API requests to the gutindex API. "
-                            "Below is the documentation required to use this API. Make your best judgement as to the query required "
-                            "in order to return the most appropriate books. Only provide the API request and nothing else. Unless asked otherwise, provide books only in english. \n\n"
-                            "Lists of Books\n"
-                            "Lists of book information in the database are queried using the API at /books (e.g. gutendex.com/books). "
-                            "Book data will be returned in the format\n\n"
-                            "{\n  \"count\": <number>,\n  \"next\": <string or null>,\n  \"previous\": <string or null>,\n  "
-                            "\"results\": <array of Books>\n}\n"
-                            "where results is an array of 0-32 book objects, next and previous are URLs to the next and previous pages of results, "
-                            "and count in the total number of books for the query on all pages combined.\n\n"
-                            "By default, books are ordered by popularity, determined by their numbers of downloads from Project Gutenberg.\n\n"
-                            "Parameters can also be added to book-list queries in a typical URL format. For example, to get the first page of written by authors alive after 1899 "
-                            "and published in English or French, you can go to /books?author_year_start=1900&languages=en,fr\n\n"
-                            "You can find available query parameters below.\n\n"
-                            "author_year_start and author_year_end\n"
-                            "Use these to find books with at least one author alive in a given range of years. They must have positive or negative integer values. "
-                            "For example, /books?author_year_end=-499 gives books with authors alive before 500 BCE, and /books?author_year_start=1800&author_year_end=1899 gives books with authors alive in the 19th Century.\n\n"
-                            "copyright\n"
-                            "Use this to find books with a certain copyright status: true for books with existing copyrights, false for books in the public domain in the USA, "
-                            "or null for books with no available copyright information. These can be combined with commas. For example, /books?copyright=true,false gives books with available copyright information.\n\n"
-                            "ids\n"
-                            "Use this to list books with Project Gutenberg ID numbers in a given list of numbers. They must be comma-separated positive integers. "
-                            "For example, /books?ids=11,12,13 gives books with ID numbers 11, 12, and 13.\n\n"
-                            "languages\n"
-                            "Use this to find books in any of a list of languages. They must be comma-separated, two-character language codes. "
-                            "For example, /books?languages=en gives books in English, and /books?languages=fr,fi gives books in either French or Finnish or both.\n\n"
-                            "mime_type\n"
-                            "Use this to find books with a given MIME type. Gutendex gives every book with a MIME type starting with the value. "
-                            "For example, /books?mime_type=text%2F gives books with types text/html, text/plain; charset=us-ascii, etc.; and /books?mime_type=text%2Fhtml gives books with types text/html, text/html; charset=utf-8, etc.\n\n"
-                            "search\n"
-                            "Use this to search author names and book titles with given words. They must be separated by a space (i.e. %20 in URL-encoded format) and are case-insensitive. "
-                            "For example, /books?search=dickens%20great includes Great Expectations by Charles Dickens.\n\n"
-                            "sort\n"
-                            "Use this to sort books: ascending for Project Gutenberg ID numbers from lowest to highest, descending for IDs highest to lowest, or popular (the default) for most popular to least popular by number of downloads.\n\n"
-                            "topic\n"
-                            "Use this to search for a case-insensitive key-phrase in books' bookshelves or subjects. For example, /books?topic=children gives books on the \"Children's Literature\" bookshelf, with the subject \"Sick children -- Fiction\", and so on.\n\n"
-                            "Individual Books\n"
-                            "Individual books can be found at /books/<id>, where <id> is the book's Project Gutenberg ID number. Error responses will appear in this format:\n\n"
-                            "{\n  \"detail\": <string of error message>\n}\n"
-                            "API Objects\n"
-                            "Types of JSON objects served by Gutendex are given below.\n\n"
-                            "Book\n"
-                            "{\n  \"id\": <number of Project Gutenberg ID>,\n  \"title\": <string>,\n  \"subjects\": <array of strings>,\n  "
-                            "\"authors\": <array of Persons>,\n  \"summaries\": <array of strings>,\n  \"translators\": <array of Persons>,\n  "
-                            "\"bookshelves\": <array of strings>,\n  \"languages\": <array of strings>,\n  \"copyright\": <boolean or null>,\n  "
-                            "\"media_type\": <string>,\n  \"formats\": <Format>,\n  \"download_count\": <number>\n}\n\n"
-                            "Format\n"
-                            "{\n  <string of MIME-type>: <string of URL>,\n  ...\n}\n\n"
-                            "Person\n"
-                            "{\n  \"birth_year\": <number or null>,\n  \"death_year\": <number or null>,\n  \"name\": <string>\n}\n"
-                        )
-                    }
-                ]
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": user_query
-                    }
-                ]
-            }
-        ],
-        response_format={"type": "text"},
-        temperature=0.5,
-        max_completion_tokens=2048,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0
-    )
-    parsed_query = response.choices[0].message.content
-    print(parsed_query)
+    query_params = translate_query(user_query)
     try:
         # Make the request to Gutendex API with the given query parameters
-        api_response = requests.get(GUTENDEX_URL, params=parsed_query)
-        api_response.raise_for_status()  # Raise an error for bad responses (4xx, 5xx)
+        data = fetch_gutendex(query_params)
         
         # Process the API response to tidy up the output
-        data = api_response.json()
         count = data.get("count", 0)
         results = data.get("results", [])
-        tidy_books = []
-        for book in results:
-            # Construct a tidy book object
-            tidy_book = {
-                "id": book.get("id"),
-                "title": book.get("title"),
-                "authors": book.get("authors"),
-                "subjects": book.get("subjects"),
-                "languages": book.get("languages")
-            }
-            # Combine summaries into a single string, if available
-            summaries = book.get("summaries")
-            tidy_book["summary"] = " ".join(summaries) if summaries else None
-            
-            # Extract the cover image from formats
-            formats = book.get("formats", {})
-            cover_image = formats.get("image/jpeg")
-            if not cover_image:
-                # Fallback: use any format that starts with "image"
-                for mime, url in formats.items():
-                    if mime.startswith("image"):
-                        cover_image = url
-                        break
-            tidy_book["image"] = cover_image
-            
-            # Extract the zip file for download
-            tidy_book["book_download"] = formats.get("application/zip")
-            
-            tidy_books.append(tidy_book)
-            print(tidy_book)
+        with stage_timer("tidy"):
+            tidy_books = [make_tidy_book(book) for book in results]
         
-        return jsonify({
+        return payload_response({
             "count": count,
             "results": tidy_books
-        }), 200
+        }, slim=slim)
 
     except requests.exceptions.RequestException as e:
         abort(500, description=f"Error querying Gutendex API: {e}")
@@ -174,116 +497,478 @@ def format_message(message):
     }
 
 
-def get_tidy_books(query_params, n):
+def build_chat_messages(conversation, summary=None):
     """
-    Makes the GET request to Gutendex API using a dictionary of query parameters and returns a list
-    of tidy book objects, limited to n books. It checks for duplicates based on both book id and the
-    (title, authors) combination.
+    Formats a conversation for GPT4o, adding the default librarian system message
+    when the conversation doesn't provide its own. A summary of earlier, compacted
+    turns goes right after the system messages.
     """
-    response = requests.get(GUTENDEX_URL, params=query_params)
-    response.raise_for_status()  # Raise an error for bad responses (4xx, 5xx)
+    formatted_messages = []
     
-    data = response.json()
-    results = data.get("results", [])
-    tidy_books = []
-    seen_ids = set()
-    seen_keys = set()  # Track (title, authors) duplicates
-    for book in results:
+    if not any(msg.get("role") == "system" for msg in conversation):
+        formatted_messages.append({
+            "role": "system",
+            "content": [
+                { "type": "text", "text": "You are a helpful librarian assistant. Please format your responses as plain text." }
+            ]
+        })
+    
+    for msg in conversation:
+        formatted_messages.append(format_message(msg))
+
+    if summary:
+        insert_after_system(formatted_messages, summary_message(summary))
+    return formatted_messages
+
+
+def insert_after_system(formatted_messages, message):
+    """
+    Inserts a formatted message right after the leading system messages.
+    """
+    position = next(
+        (i for i, msg in enumerate(formatted_messages) if msg["role"] != "system"), len(formatted_messages)
+    )
+    formatted_messages.insert(position, message)
+    return formatted_messages
+
+
+def split_chat(conversation):
+    return split_conversation(
+        conversation,
+        CHAT_TOKEN_BUDGET,
+        keep_recent=CHAT_KEEP_RECENT,
+        fold_block=max(CHAT_FOLD_BLOCK, 1),
+        summary_tokens=CHAT_SUMMARY_TOKENS
+    )
+
+
+def compact_conversation(conversation):
+    """
+    Keeps a long conversation within CHAT_TOKEN_BUDGET. Returns the system messages and
+    recent turns to send verbatim, and the summary of the older turns (None when nothing
+    needed folding). Summaries are cached per folded prefix and extended a block at a
+    time, so the model is only asked to summarize when another block gets folded. If the
+    summary can't be made, the older turns are dropped instead.
+    """
+    system, folded, recent = split_chat(conversation)
+    if not folded:
+        return conversation, None
+    summary = summary_cache.get(folded)
+    if summary is None:
+        previous_summary, turns = summary_cache.latest(folded)
+        try:
+            with stage_timer("chat_compaction"):
+                response = openai_chat_upstream.call(_complete_summary, previous_summary, turns)
+        except Exception as e:
+            # Compaction only saves tokens, so it mustn't fail the turn: send the recent
+            # turns with the last summary there is (if any) instead.
+            logger.warning("Summarizing the conversation failed, truncating it instead: %s", e)
+            return system + recent, previous_summary
+        summary = response.choices[0].message.content.strip()
+        summary_cache.set(folded, summary)
+    return system + recent, summary
+
+
+def _complete_summary(timeout, previous_summary, turns):
+    return client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+        model=CHAT_SUMMARY_MODEL,
+        messages=build_summary_messages(previous_summary, turns),
+        response_format={"type": "text"},
+        temperature=0,
+        max_completion_tokens=CHAT_SUMMARY_TOKENS
+    )
+
+
+def make_tidy_book(book):
+    """
+    Converts a raw Gutendex book object into the tidy book shape returned by the API.
+    """
+    formats = book.get("formats", {})
+    # Extract the cover image from formats
+    cover_image = formats.get("image/jpeg")
+    if not cover_image:
+        # Fallback: use any format that starts with "image"
+        for mime, url in formats.items():
+            if mime.startswith("image"):
+                cover_image = url
+                break
+    # Combine summaries into a single string, if available
+    summaries = book.get("summaries")
+    return {
+        "id": book.get("id"),
+        "title": (book.get("title") or "").strip(),
+        "authors": book.get("authors"),
+        "subjects": book.get("subjects"),
+        "bookshelves": book.get("bookshelves"),
+        "languages": book.get("languages"),
+        "summary": " ".join(summaries) if summaries else None,
+        "image": cover_image,
+        # Extract the zip file for download
+        "book_download": formats.get("application/zip")
+    }
+
+
+def book_key(book):
+    """
+    Returns the (title, authors) combination used to spot the same book under different ids.
+    """
+    title = (book.get("title") or "").strip()
+    authors = [author.get("name", "").strip() for author in book.get("authors") or []]
+    return (title, tuple(sorted(authors)))
+
+
+class BookCollector:
+    """
+    Accumulates tidy books from one or more pages of Gutendex results until n books are
+    collected. It checks for duplicates based on both book id and the (title, authors)
+    combination. Books in exclude (e.g. those already in the graph) are skipped and don't
+    count towards n.
+    """
+
+    def __init__(self, n, exclude=()):
+        self.n = n
+        self.books = []
+        # Book id and (title, authors) -> position of the collected book in self.books,
+        # or None for excluded books.
+        self.seen_ids = {}
+        self.seen_keys = {}  # Track (title, authors) duplicates
+        for book in exclude:
+            self.seen_ids[book.get("id")] = None
+            self.seen_keys[book_key(book)] = None
+
+    @property
+    def done(self):
+        return len(self.books) >= self.n
+
+    def claim(self, book):
+        """
+        Returns (position, is_new) for a raw or tidy book: the position in self.books that
+        the book, or the copy of it already collected, has, and whether it still needs to be
+        appended there. The position is None for excluded books.
+        """
         book_id = book.get("id")
-        if book_id in seen_ids:
-            continue
-        seen_ids.add(book_id)
-        
-        title = book.get("title", "").strip()
-        authors = [author.get("name", "").strip() for author in book.get("authors", [])]
-        key = (title, tuple(sorted(authors)))
-        if key in seen_keys:
-            continue
-        seen_keys.add(key)
-        
-        tidy_book = {
-            "id": book_id,
-            "title": title,
-            "authors": book.get("authors"),
+        if book_id in self.seen_ids:
+            return self.seen_ids[book_id], False
+
+        key = book_key(book)
+        if key in self.seen_keys:
+            self.seen_ids[book_id] = self.seen_keys[key]
+            return self.seen_keys[key], False
+        position = self.seen_ids[book_id] = self.seen_keys[key] = len(self.books)
+        return position, True
+
+    def add_results(self, results):
+        """
+        Adds the books of one page of results and returns True once n books are collected.
+        """
+        for book in results:
+            if self.done:
+                break
+            _, is_new = self.claim(book)
+            if is_new:
+                self.books.append(make_tidy_book(book))
+        return self.done
+
+
+def later_page_params(query_params, first_page):
+    """
+    Returns the query parameters for every page after first_page, using the total count
+    and the first page's size to work out how far Gutendex's `next` links go.
+    """
+    if not first_page.get("next"):
+        return []
+    page_size = len(first_page.get("results", [])) or 32
+    last_page = math.ceil(first_page.get("count", 0) / page_size)
+    return [dict(query_params, page=page) for page in range(2, last_page + 1)]
+
+
+def get_tidy_books(query_params, n, exclude=()):
+    """
+    Makes the GET request to Gutendex API using a dictionary of query parameters and returns a list
+    of tidy book objects, limited to n books. It checks for duplicates based on both book id and the
+    (title, authors) combination, and skips the tidy books in exclude.
+    When the first page holds fewer than n unique books, later pages are fetched concurrently
+    with at most GUTENDEX_PREFETCH_PAGES requests ahead. Pages are processed in order as they
+    arrive and fetching stops as soon as n unique books are collected.
+    """
+    data = fetch_gutendex(query_params)
+    collector = BookCollector(n, exclude)
+    with stage_timer("tidy"):
+        done = collector.add_results(data.get("results", []))
+    if done:
+        return remember_books(collector.books)
+
+    pages = iter(later_page_params(query_params, data))
+    window = deque()
+
+    def prefetch_next_page():
+        params = next(pages, None)
+        if params is not None:
+            # Run in a copy of the request context so the fetch is timed for this request.
+            window.append(gutendex_executor.submit(contextvars.copy_context().run, fetch_gutendex, params))
+
+    for _ in range(GUTENDEX_PREFETCH_PAGES):
+        prefetch_next_page()
+    try:
+        while window:
+            data = window.popleft().result()
+            prefetch_next_page()
+            with stage_timer("tidy"):
+                done = collector.add_results(data.get("results", []))
+            if done:
+                break
+    finally:
+        # Drop any prefetches that haven't started yet.
+        for future in window:
+            future.cancel()
+    return remember_books(collector.books)
+
+
+def remember_books(tidy_books):
+    for book in tidy_books:
+        known_books.set(book["id"], book)
+    return tidy_books
+
+
+def id_query_params(book_ids, page_size=32):
+    """
+    Splits Gutenberg IDs into Gutendex "ids" queries of at most one page each.
+    """
+    book_ids = sorted(set(book_ids))
+    return [
+        {"ids": ",".join(str(book_id) for book_id in book_ids[start:start + page_size])}
+        for start in range(0, len(book_ids), page_size)
+    ]
+
+
+def parse_book_ids(values):
+    """
+    Converts a list of Gutenberg IDs given as numbers or strings to ints.
+    Raises ValueError for anything that isn't an ID.
+    """
+    if not isinstance(values, list):
+        raise ValueError("expected a list of Gutenberg IDs")
+    book_ids = []
+    for value in values:
+        if isinstance(value, bool) or not str(value).strip().isdigit():
+            raise ValueError(f"{value!r} is not a Gutenberg ID")
+        book_ids.append(int(value))
+    return book_ids
+
+
+def get_books_by_id(book_ids):
+    """
+    Returns the tidy books for a list of Gutenberg IDs, in the same order. Books seen by
+    earlier queries are taken from known_books and the rest are fetched from Gutendex by
+    ID. IDs that Gutendex doesn't know are left out.
+    """
+    missing = [book_id for book_id in book_ids if known_books.get(book_id) is None]
+    futures = [
+        gutendex_executor.submit(contextvars.copy_context().run, fetch_gutendex, params)
+        for params in id_query_params(missing)
+    ]
+    for future in futures:
+        data = future.result()
+        remember_books([make_tidy_book(book) for book in data.get("results", [])])
+    books = (known_books.get(book_id) for book_id in book_ids)
+    return [book for book in books if book is not None]
+
+
+def book_attributes(book):
+    """
+    Returns the set of (kind, value) attributes used to link a book to others:
+    its authors, subjects and bookshelves.
+    """
+    attributes = set()
+    for author in book.get("authors") or []:
+        name = author.get("name", "").strip()
+        if name:
+            attributes.add(("author", name))
+    for subject in book.get("subjects") or []:
+        attributes.add(("subject", subject.strip()))
+    for bookshelf in book.get("bookshelves") or []:
+        attributes.add(("bookshelf", bookshelf.strip()))
+    return attributes
+
+
+def make_node_id(book, position):
+    book_id = book.get("id")
+    return str(book_id) if book_id is not None else f"node{position}"
+
+
+def make_node(book, position):
+    """
+    Builds a graph node for a tidy book. The node ID is the book's Gutenberg ID, so it
+    stays the same whichever query or graph the book shows up in.
+    """
+    book_id = book.get("id")
+    node_id = make_node_id(book, position)
+    authors_list = [author.get("name", "").strip() for author in book.get("authors") or []]
+    return {
+        "id": node_id,
+        "text": node_id,
+        "data": {
+            "pic": book.get("image"),  # existing variable
+            "title": book.get("title"),  # existing variable
+            "author": ", ".join(authors_list),  # existing variable
+            "slotType": f"slot{position+1}",  # existing variable
+            # Additional book data from query_books:
+            "gutindex_id": book_id,
             "subjects": book.get("subjects"),
-            "languages": book.get("languages")
+            "bookshelves": book.get("bookshelves"),
+            "languages": book.get("languages"),
+            "summary": book.get("summary"),
+            "book_download": book.get("book_download")
         }
-        summaries = book.get("summaries")
-        tidy_book["summary"] = " ".join(summaries) if summaries else None
-
-        formats = book.get("formats", {})
-        cover_image = formats.get("image/jpeg")
-        if not cover_image:
-            # Fallback: use any format that starts with "image"
-            for mime, url in formats.items():
-                if mime.startswith("image"):
-                    cover_image = url
+    }
+
+
+def make_line(from_id, to_id, shared):
+    """
+    Builds a graph edge between two nodes from the list of attributes they share.
+    """
+    shared = sorted(shared, key=lambda attribute: (-EDGE_WEIGHTS[attribute[0]], attribute))
+    return {
+        "from": from_id,
+        "to": to_id,
+        "weight": sum(EDGE_WEIGHTS[kind] for kind, _ in shared),
+        "reason": " ".join(EDGE_REASONS[kind].format(value) for kind, value in shared)
+    }
+
+
+def find_edges(attribute_sets, max_degree=GRAPH_MAX_DEGREE, existing=0):
+    """
+    Picks which books to connect using an inverted index from attribute to books rather
+    than comparing every pair. attribute_sets holds book_attributes() for each book and
+    the result is a list of (i, j) positions.
+    Attributes are visited from the most specific (authors, then rarer subjects and
+    bookshelves) to the most generic, and each book is linked to the next few books
+    sharing the attribute until it reaches max_degree edges, so large graphs don't
+    turn into a hairball and the work stays proportional to the number of edges kept.
+    The first `existing` books are already in the graph and linked to each other. They
+    are only paired with the books after them (existing books first), and max_degree
+    then limits how many new edges each of them gets.
+    """
+    index = defaultdict(list)
+    for position, attributes in enumerate(attribute_sets):
+        for attribute in attributes:
+            index[attribute].append(position)
+    ordered = sorted(
+        (item for item in index.items() if len(item[1]) > 1),
+        key=lambda item: (-EDGE_WEIGHTS[item[0][0]], len(item[1]), item[0])
+    )
+
+    degrees = [0] * len(attribute_sets)
+    linked = set()
+    pairs = []
+    for _, members in ordered:
+        open_members = [position for position in members if degrees[position] < max_degree]
+        # Positions are ascending, so existing books come first.
+        split = bisect.bisect_left(open_members, existing)
+        old_members, new_members = open_members[:split], open_members[split:]
+        for x, i in enumerate(new_members):
+            for j in itertools.chain(old_members, new_members[x + 1:x + 1 + max_degree]):
+                if degrees[i] >= max_degree:
                     break
-        tidy_book["image"] = cover_image
-        tidy_book["book_download"] = formats.get("application/zip")
-        
-        tidy_books.append(tidy_book)
-        if len(tidy_books) == n:
-            break
-    return tidy_books
+                if degrees[j] >= max_degree or (i, j) in linked:
+                    continue
+                linked.add((i, j))
+                degrees[i] += 1
+                degrees[j] += 1
+                pairs.append((i, j))
+    return pairs
+
+
+def find_similarity_lines(books, node_ids, max_degree=GRAPH_MAX_DEGREE, existing=0):
+    """
+    Links each book from position `existing` on to its max_degree most similar books by
+    the TF-IDF cosine similarity of their subjects, bookshelves and summaries. Each line's
+    weight is the similarity and its reason names the terms that contribute most to it.
+    """
+    matrix, terms = book_vectors.matrix(books)
+    i, j, scores = top_k_pairs(matrix, max_degree, SIMILARITY_MIN_SCORE, start=existing)
+    shared = shared_top_terms(matrix, i, j, terms)
+    return [
+        {
+            "from": node_ids[a],
+            "to": node_ids[b],
+            "weight": round(score, 3),
+            "reason": EDGE_REASONS["similarity"].format(", ".join(terms))
+        }
+        for a, b, score, terms in zip(i.tolist(), j.tolist(), scores.tolist(), shared)
+    ]
 
 
-def build_graph_from_books(tidy_books):
+def build_graph_from_books(tidy_books, max_degree=GRAPH_MAX_DEGREE, existing_books=(), edge_mode="attributes"):
     """
     Transforms a list of tidy books into a graph structure.
-    Node IDs are assigned as lowercase letters starting with 'a'.
-    Nodes are connected only if they share at least one common author.
+    Node IDs are the books' Gutenberg IDs.
+    With the "attributes" edge_mode, nodes are connected when they share an author, subject
+    or bookshelf. Each edge carries a weight and a human-readable reason, and each node
+    keeps at most max_degree edges, preferring shared authors and then the most specific
+    shared subjects and bookshelves. With "similarity", find_similarity_lines links each
+    node to its max_degree most similar books instead.
     In each node's data, we include the existing keys (pic, title, author, slotType)
     plus all of the book data from the tidy_books object.
+    When existing_books (the books already in the client's graph) are given, only the
+    difference is returned: nodes for tidy_books and lines that involve at least one of
+    them, some of which point at existing nodes. Pairs of existing books are not revisited.
     """
-    nodes = []
-    letters = list(string.ascii_lowercase)
-    
-    # Build nodes and temporarily store list of author names for connection logic.
-    for i, book in enumerate(tidy_books):
-        node_id = letters[i] if i < len(letters) else str(i)
-        # Extract list of author names from the book.
-        authors_list = [author.get("name", "").strip() for author in book.get("authors", [])]
-        node = {
-            "id": node_id,
-            "text": node_id,
-            "data": {
-                "pic": book.get("image"),  # existing variable
-                "title": book.get("title"),  # existing variable
-                "author": ", ".join(authors_list),  # existing variable
-                "slotType": f"slot{i+1}",  # existing variable
-                # Additional book data from query_books:
-                "subjects": book.get("subjects"),
-                "languages": book.get("languages"),
-                "summary": book.get("summary"),
-                "book_download": book.get("book_download"),
-                "authors_list": authors_list  # temporary field for edge-building
-            }
-        }
-        nodes.append(node)
-    
-    # Build edges only if two nodes share at least one common author.
-    lines = []
-    for i in range(len(nodes)):
-        for j in range(i + 1, len(nodes)):
-            if set(nodes[i]["data"]["authors_list"]).intersection(nodes[j]["data"]["authors_list"]):
-                lines.append({
-                    "from": nodes[i]["id"],
-                    "to": nodes[j]["id"]
-                })
-    
-    # Remove the temporary authors_list field from nodes before output.
-    for node in nodes:
-        node["data"].pop("authors_list", None)
-    
+    with stage_timer("build_graph"):
+        offset = len(existing_books)
+        nodes = [make_node(book, offset + i) for i, book in enumerate(tidy_books)]
+        node_ids = [make_node_id(book, i) for i, book in enumerate(existing_books)]
+        node_ids.extend(node["id"] for node in nodes)
+
+        if edge_mode == "similarity":
+            books = list(itertools.chain(existing_books, tidy_books))
+            lines = find_similarity_lines(books, node_ids, max_degree, existing=offset)
+        else:
+            attribute_sets = [book_attributes(book) for book in itertools.chain(existing_books, tidy_books)]
+            lines = [
+                make_line(node_ids[i], node_ids[j], attribute_sets[i] & attribute_sets[j])
+                for i, j in find_edges(attribute_sets, max_degree, existing=offset)
+            ]
+
     graph = {
-        "rootId": nodes[0]["id"] if nodes else None,
+        "rootId": node_ids[0] if node_ids else None,
         "nodes": nodes,
         "lines": lines
     }
     return graph
 
 
+def parse_edge_mode(data):
+    """
+    Returns the edge mode a graph request asked for with "edges", or GRAPH_EDGE_MODE.
+    """
+    edge_mode = data.get("edges", GRAPH_EDGE_MODE)
+    if edge_mode not in EDGE_MODES:
+        raise ValueError(f"edges must be one of {', '.join(EDGE_MODES)}")
+    return edge_mode
+
+
+def wants_thumbnails(data, args):
+    """
+    Returns True when the client asked for proxied cover thumbnails, with
+    "thumbnails": true in the body or ?thumbnails=1.
+    """
+    return data.get("thumbnails") is True or args.get("thumbnails") in ("1", "true")
+
+
+def rewrite_pics(graph, base_url, width=COVER_THUMBNAIL_WIDTH):
+    """
+    Points each node's pic at its thumbnail from the /covers proxy under base_url. The
+    original cover URL is kept in pic_full.
+    """
+    for node in graph["nodes"]:
+        data = node["data"]
+        if data.get("pic") and data.get("gutindex_id") is not None:
+            data["pic_full"] = data["pic"]
+            data["pic"] = f"{base_url.rstrip('/')}/covers/{data['gutindex_id']}?w={width}"
+    return graph
+
+
 @app.route("/query_books_graph", methods=["POST"])
 def query_books_graph():
     data = request.get_json()
@@ -303,111 +988,243 @@ def query_books_graph():
             abort(400, description="Bad Request: n must be at least 1")
     except ValueError:
         abort(400, description="Bad Request: n must be an integer")
+    if n > MAX_BOOKS:
+        abort(400, description=f"Bad Request: n must be at most {MAX_BOOKS}")
     
+    # Expansion mode: the Gutenberg IDs already in the client's graph.
+    try:
+        existing_ids = parse_book_ids(data.get("existing_ids", []))
+        edge_mode = parse_edge_mode(data)
+    except ValueError as e:
+        abort(400, description=f"Bad Request: {e}")
+    if len(existing_ids) > EXPAND_MAX_IDS:
+        abort(400, description=f"Bad Request: at most {EXPAND_MAX_IDS} existing_ids are allowed")
+
     user_query = data["query"]
 
-    # Use the OpenAI client to generate the parsed query string.
-    response = client.chat.completions.create(
+    # Translate the natural-language query into Gutendex query parameters.
+    query_params = translate_query(user_query)
+    logger.debug("Final query parameters: %s", query_params)
+    
+    try:
+        existing_books = get_books_by_id(existing_ids) if existing_ids else []
+        tidy_books = get_tidy_books(query_params, n, exclude=existing_books)
+        graph = build_graph_from_books(tidy_books, existing_books=existing_books, edge_mode=edge_mode)
+        if wants_thumbnails(data, request.args):
+            rewrite_pics(graph, COVER_BASE_URL or request.url_root)
+        return payload_response(graph, slim=wants_slim(data, request.args))
+    except requests.exceptions.RequestException as e:
+        abort(500, description=f"Error querying Gutendex API: {e}")
+
+def parse_batch_items(data):
+    """
+    Validates the body of a batch graph request and returns its queries as a list of
+    {"query": ..., "n": ...} items. Raises ValueError describing the first problem found.
+    """
+    items = data.get("queries")
+    if not isinstance(items, list) or not items:
+        raise ValueError("queries must be a non-empty list")
+    if len(items) > BATCH_MAX_QUERIES:
+        raise ValueError(f"at most {BATCH_MAX_QUERIES} queries are allowed")
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("query"):
+            raise ValueError(f"queries[{index}] has no query")
+        try:
+            n = int(item.get("n", 10))
+        except (TypeError, ValueError):
+            raise ValueError(f"queries[{index}].n must be an integer")
+        if n < 1:
+            raise ValueError(f"queries[{index}].n must be at least 1")
+        if n > MAX_BOOKS:
+            raise ValueError(f"queries[{index}].n must be at most {MAX_BOOKS}")
+        parsed.append({"query": item["query"], "n": n})
+    return parsed
+
+
+def merge_batch_graph(items, outcomes, edge_mode="attributes"):
+    """
+    Merges the books found by each query of a batch into one graph. outcomes holds, for
+    each item, either its list of tidy books or the exception the query failed with.
+    Books are deduplicated across queries the same way get_tidy_books deduplicates pages,
+    and each node's data lists the queries that found it under "provenance". The graph
+    also gets a "queries" entry summarizing how each query went.
+    """
+    collector = BookCollector(math.inf)
+    provenance = []
+    summaries = []
+    for index, (item, outcome) in enumerate(zip(items, outcomes)):
+        summary = {"index": index, "query": item["query"], "n": item["n"]}
+        if isinstance(outcome, Exception):
+            summaries.append(dict(summary, error=str(outcome)))
+            continue
+        summaries.append(dict(summary, count=len(outcome)))
+        for book in outcome:
+            position, is_new = collector.claim(book)
+            if is_new:
+                collector.books.append(book)
+                provenance.append([])
+            if not provenance[position] or provenance[position][-1]["index"] != index:
+                provenance[position].append({"index": index, "query": item["query"]})
+
+    graph = build_graph_from_books(collector.books, edge_mode=edge_mode)
+    for node, sources in zip(graph["nodes"], provenance):
+        node["data"]["provenance"] = sources
+    graph["queries"] = summaries
+    return graph
+
+
+def run_batch_item(item):
+    return get_tidy_books(translate_query(item["query"]), item["n"])
+
+
+@app.route("/query_books_graph_batch", methods=["POST"])
+def query_books_graph_batch():
+    data = request.get_json()
+    if not data or "queries" not in data:
+        abort(400, description="Bad Request: No queries provided")
+
+    # Validate API key from headers.
+    api_key = request.headers.get("Authorization")
+    if not api_key or api_key != f"Bearer {REQUIRED_API_KEY}":
+        abort(401, description="Unauthorized: Invalid or missing API key")
+
+    try:
+        items = parse_batch_items(data)
+        edge_mode = parse_edge_mode(data)
+    except ValueError as e:
+        abort(400, description=f"Bad Request: {e}")
+
+    # Each query runs in a copy of the request context so its stages are timed for this request.
+    futures = [batch_executor.submit(contextvars.copy_context().run, run_batch_item, item) for item in items]
+    outcomes = []
+    for item, future in zip(items, futures):
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            logger.warning("Batch query %r failed: %s", item["query"], e)
+            outcomes.append(e)
+    if all(isinstance(outcome, Exception) for outcome in outcomes):
+        abort(500, description=f"Error processing batch: {outcomes[0]}")
+
+    graph = merge_batch_graph(items, outcomes, edge_mode)
+    if wants_thumbnails(data, request.args):
+        rewrite_pics(graph, COVER_BASE_URL or request.url_root)
+    return payload_response(graph, slim=wants_slim(data, request.args))
+
+
+@app.route("/book_summaries", methods=["POST"])
+def book_summaries():
+    data = request.get_json()
+    if not data or "ids" not in data:
+        abort(400, description="Bad Request: No ids provided")
+
+    # Validate API key from headers.
+    api_key = request.headers.get("Authorization")
+    if not api_key or api_key != f"Bearer {REQUIRED_API_KEY}":
+        abort(401, description="Unauthorized: Invalid or missing API key")
+
+    try:
+        book_ids = parse_book_ids(data["ids"])
+    except ValueError as e:
+        abort(400, description=f"Bad Request: {e}")
+    if len(book_ids) > SUMMARIES_MAX_IDS:
+        abort(400, description=f"Bad Request: at most {SUMMARIES_MAX_IDS} ids are allowed")
+
+    try:
+        books = get_books_by_id(book_ids)
+    except requests.exceptions.RequestException as e:
+        abort(500, description=f"Error querying Gutendex API: {e}")
+    return payload_response({"summaries": {str(book["id"]): book.get("summary") for book in books}})
+
+def wants_event_stream(data, accept):
+    """
+    Returns True when the client asked for a streamed reply, either with "stream": true
+    in the body or an Accept: text/event-stream header.
+    """
+    return data.get("stream") is True or "text/event-stream" in (accept or "")
+
+
+def sse_event(event, payload):
+    """
+    Formats one Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def stream_chat_events(stream, started_at):
+    """
+    Forwards the tokens of a streamed chat completion as "token" events as they arrive,
+    then sends a final "done" event with the token usage and timing.
+    """
+    first_token_at = None
+    usage = None
+    try:
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage.model_dump()
+            for choice in chunk.choices:
+                token = choice.delta.content
+                if token:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    yield sse_event("token", {"text": token})
+    except Exception as e:
+        yield sse_event("error", {"message": f"Error processing chat: {e}"})
+        return
+    yield chat_done_event(usage, started_at, first_token_at)
+
+
+def chat_done_event(usage, started_at, first_token_at):
+    """
+    Builds the final "done" event of a streamed chat reply.
+    """
+    finished_at = time.perf_counter()
+    return sse_event("done", {
+        "usage": usage,
+        "timing": {
+            "time_to_first_token_ms": round((first_token_at - started_at) * 1000, 1) if first_token_at else None,
+            "total_ms": round((finished_at - started_at) * 1000, 1)
+        }
+    })
+
+
+# Headers that stop proxies (e.g. nginx) from buffering streamed replies.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _complete_chat(timeout, formatted_messages, stream):
+    # For a stream, timeout bounds the wait for the response and then for each chunk.
+    return client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
         model="gpt-4o",
-        messages=[
-            {
-                "role": "system",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": (
-                            "You are a helpful librarian assistant that is designed to assist users with finding, "
-                            "discovering and exploring books on Project Gutenberg by making API requests to the gutindex API. "
-                            "Below is the documentation required to use this API. Make your best judgement as to the query required "
-                            "in order to return the most appropriate books. Only provide the API request and nothing else. Unless asked otherwise, provide books only in english. \n\n"
-                            "Lists of Books\n"
-                            "Lists of book information in the database are queried using the API at /books (e.g. gutendex.com/books). "
-                            "Book data will be returned in the format\n\n"
-                            "{\n  \"count\": <number>,\n  \"next\": <string or null>,\n  \"previous\": <string or null>,\n  "
-                            "\"results\": <array of Books>\n}\n"
-                            "where results is an array of 0-32 book objects, next and previous are URLs to the next and previous pages of results, "
-                            "and count in the total number of books for the query on all pages combined.\n\n"
-                            "By default, books are ordered by popularity, determined by their numbers of downloads from Project Gutenberg.\n\n"
-                            "Parameters can also be added to book-list queries in a typical URL format. For example, to get the first page of written by authors alive after 1899 "
-                            "and published in English or French, you can go to /books?author_year_start=1900&languages=en,fr\n\n"
-                            "You can find available query parameters below.\n\n"
-                            "author_year_start and author_year_end\n"
-                            "Use these to find books with at least one author alive in a given range of years. They must have positive or negative integer values. "
-                            "For example, /books?author_year_end=-499 gives books with authors alive before 500 BCE, and /books?author_year_start=1800&author_year_end=1899 gives books with authors alive in the 19th Century.\n\n"
-                            "copyright\n"
-                            "Use this to find books with a certain copyright status: true for books with existing copyrights, false for books in the public domain in the USA, "
-                            "or null for books with no available copyright information. These can be combined with commas. For example, /books?copyright=true,false gives books with available copyright information.\n\n"
-                            "ids\n"
-                            "Use this to list books with Project Gutenberg ID numbers in a given list of numbers. They must be comma-separated positive integers. "
-                            "For example, /books?ids=11,12,13 gives books with ID numbers 11, 12, and 13.\n\n"
-                            "languages\n"
-                            "Use this to find books in any of a list of languages. They must be comma-separated, two-character language codes. "
-                            "For example, /books?languages=en gives books in English, and /books?languages=fr,fi gives books in either French or Finnish or both.\n\n"
-                            "mime_type\n"
-                            "Use this to find books with a given MIME type. Gutendex gives every book with a MIME type starting with the value. "
-                            "For example, /books?mime_type=text%2F gives books with types text/html, text/plain; charset=us-ascii, etc.; and /books?mime_type=text%2Fhtml gives books with types text/html, text/html; charset=utf-8, etc.\n\n"
-                            "search\n"
-                            "Use this to search author names and book titles with given words. They must be separated by a space (i.e. %20 in URL-encoded format) and are case-insensitive. "
-                            "For example, /books?search=dickens%20great includes Great Expectations by Charles Dickens.\n\n"
-                            "sort\n"
-                            "Use this to sort books: ascending for Project Gutenberg ID numbers from lowest to highest, descending for IDs highest to lowest, or popular (the default) for most popular to least popular by number of downloads.\n\n"
-                            "topic\n"
-                            "Use this to search for a case-insensitive key-phrase in books' bookshelves or subjects. For example, /books?topic=children gives books on the \"Children's Literature\" bookshelf, with the subject \"Sick children -- Fiction\", and so on.\n\n"
-                            "Individual Books\n"
-                            "Individual books can be found at /books/<id>, where <id> is the book's Project Gutenberg ID number. Error responses will appear in this format:\n\n"
-                            "{\n  \"detail\": <string of error message>\n}\n"
-                            "API Objects\n"
-                            "Types of JSON objects served by Gutendex are given below.\n\n"
-                            "Book\n"
-                            "{\n  \"id\": <number of Project Gutenberg ID>,\n  \"title\": <string>,\n  \"subjects\": <array of strings>,\n  "
-                            "\"authors\": <array of Persons>,\n  \"summaries\": <array of strings>,\n  \"translators\": <array of Persons>,\n  "
-                            "\"bookshelves\": <array of strings>,\n  \"languages\": <array of strings>,\n  \"copyright\": <boolean or null>,\n  "
-                            "\"media_type\": <string>,\n  \"formats\": <Format>,\n  \"download_count\": <number>\n}\n\n"
-                            "Format\n"
-                            "{\n  <string of MIME-type>: <string of URL>,\n  ...\n}\n\n"
-                            "Person\n"
-                            "{\n  \"birth_year\": <number or null>,\n  \"death_year\": <number or null>,\n  \"name\": <string>\n}\n"
-                        )
-                    }
-                ]
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": user_query
-                    }
-                ]
-            }
-        ],
+        messages=formatted_messages,
         response_format={"type": "text"},
         temperature=0.5,
         max_completion_tokens=2048,
         top_p=1,
         frequency_penalty=0,
-        presence_penalty=0
+        presence_penalty=0,
+        **({"stream": True, "stream_options": {"include_usage": True}} if stream else {})
     )
-    parsed_query = response.choices[0].message.content.strip()
-    print("Parsed query:", parsed_query)
-    
-    # Post-process the parsed query:
-    # Remove a leading '/books' if present.
-    if parsed_query.startswith('/books'):
-        parsed_query = parsed_query[len('/books'):]
-    # Remove any leading '?'.
-    if parsed_query.startswith('?'):
-        parsed_query = parsed_query[1:]
-    # Convert the query string to a dictionary of parameters.
-    query_params = dict(parse_qsl(parsed_query))
-    print("Final query parameters:", query_params)
-    
-    try:
-        tidy_books = get_tidy_books(query_params, n)
-        graph = build_graph_from_books(tidy_books)
-        return jsonify(graph), 200
-    except requests.exceptions.RequestException as e:
-        abort(500, description=f"Error querying Gutendex API: {e}")
+
+
+def chat_reply(formatted_messages, stream, started_at):
+    """
+    Sends formatted messages to the chat model and returns its reply as a JSON string,
+    or as Server-Sent Events when stream is set.
+    """
+    with stage_timer("llm_chat"):
+        response = openai_chat_upstream.call(_complete_chat, formatted_messages, stream)
+    if stream:
+        return Response(
+            stream_with_context(stream_chat_events(response, started_at)),
+            mimetype="text/event-stream",
+            headers=SSE_HEADERS
+        )
+    next_message = response.choices[0].message.content
+    logger.debug("Chat reply: %s", next_message)
+    return jsonify(next_message), 200
+
 
 @app.route("/chat", methods=["POST"])
 def chat():
@@ -420,40 +1237,203 @@ def chat():
     if not api_key or api_key != f"Bearer {REQUIRED_API_KEY}":
         abort(401, description="Unauthorized: Invalid or missing API key")
     
-    conversation = data["messages"]
-    formatted_messages = []
-    
-    if not any(msg.get("role") == "system" for msg in conversation):
-        formatted_messages.append({
-            "role": "system",
-            "content": [
-                { "type": "text", "text": "You are a helpful librarian assistant. Please format your responses as plain text." }
-            ]
-        })
-    
-    for msg in conversation:
-        formatted_messages.append(format_message(msg))
+    stream = wants_event_stream(data, request.headers.get("Accept"))
+    started_at = time.perf_counter()
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=formatted_messages,
-            response_format={"type": "text"},
-            temperature=0.5,
-            max_completion_tokens=2048,
-            top_p=1,
-            frequency_penalty=0,
-            presence_penalty=0
-        )
-        next_message = response.choices[0].message.content
-        print(next_message)
-        return jsonify(next_message), 200
+        formatted_messages = build_chat_messages(*compact_conversation(data["messages"]))
+        return chat_reply(formatted_messages, stream, started_at)
+    except Exception as e:
+        abort(500, description=f"Error processing chat: {e}")
+
+def latest_user_text(conversation):
+    return next((msg.get("text", "") for msg in reversed(conversation) if msg.get("role") == "user"), "")
+
+
+def index_book(book):
+    """
+    Returns the passage index of a tidy book, or None (logging why) when it can't be built.
+    """
+    try:
+        return book_indexes.get(book)
+    except (requests.exceptions.RequestException, LookupError, OSError, ValueError, zipfile.BadZipFile) as e:
+        logger.warning("Could not index book %s: %s", book.get("id"), e)
+        return None
+
+
+def search_passages(books, indexes, question, k=CONTEXT_TOP_K):
+    """
+    Returns the k passages of the given books that best match question, as
+    (score, book, passage) tuples, best first.
+    """
+    with stage_timer("retrieval"):
+        hits = []
+        for book, index in zip(books, indexes):
+            if index is not None:
+                hits.extend((score, book, passage) for score, _, passage in index.search(question, k))
+        return heapq.nlargest(k, hits, key=lambda hit: hit[0])
+
+
+@app.route("/context_chat", methods=["POST"])
+def context_chat():
+    data = request.get_json()
+    if not data or "messages" not in data:
+        abort(400, description="Bad Request: No messages provided in the request body")
+
+    # Validate API key from headers
+    api_key = request.headers.get("Authorization")
+    if not api_key or api_key != f"Bearer {REQUIRED_API_KEY}":
+        abort(401, description="Unauthorized: Invalid or missing API key")
+
+    try:
+        book_ids = parse_book_ids(data.get("gutindex_ids", []))
+    except ValueError as e:
+        abort(400, description=f"Bad Request: {e}")
+    if len(book_ids) > CONTEXT_MAX_BOOKS:
+        abort(400, description=f"Bad Request: at most {CONTEXT_MAX_BOOKS} gutindex_ids are allowed")
+
+    stream = wants_event_stream(data, request.headers.get("Accept"))
+    started_at = time.perf_counter()
+
+    try:
+        books = get_books_by_id(book_ids) if book_ids else []
+        # Books are downloaded and indexed the first time they're asked about.
+        with stage_timer("book_index"):
+            futures = [book_index_executor.submit(contextvars.copy_context().run, index_book, book) for book in books]
+            indexes = [future.result() for future in futures]
+        hits = search_passages(books, indexes, latest_user_text(data["messages"]))
+        formatted_messages = build_chat_messages(*compact_conversation(data["messages"]))
+        if books:
+            insert_after_system(formatted_messages, context_message(books, hits))
+        return chat_reply(formatted_messages, stream, started_at)
     except Exception as e:
         abort(500, description=f"Error processing chat: {e}")
 
+def classify_route_locally(message):
+    """
+    Returns (route, confidence, needs_fallback) from the local route classifier.
+    """
+    with stage_timer("classify_route"):
+        route, confidence = route_classifier.predict(message)
+    return route, confidence, ROUTE_LLM_FALLBACK and confidence < ROUTE_CONFIDENCE_THRESHOLD
+
+
+def _complete_route(timeout, message):
+    return client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+        model=ROUTE_LLM_MODEL,
+        messages=build_route_messages(message),
+        response_format={"type": "text"},
+        temperature=0,
+        max_completion_tokens=8
+    )
+
+
+@app.route("/classify_route", methods=["POST"])
+def classify_route():
+    data = request.get_json()
+    if not data or "message" not in data:
+        abort(400, description="Bad Request: No message provided in the request body")
+
+    # Validate API key from headers
+    api_key = request.headers.get("Authorization")
+    if not api_key or api_key != f"Bearer {REQUIRED_API_KEY}":
+        abort(401, description="Unauthorized: Invalid or missing API key")
+
+    route, confidence, needs_fallback = classify_route_locally(data["message"])
+    source = "local"
+    if needs_fallback:
+        try:
+            with stage_timer("llm_route"):
+                response = openai_upstream.call(_complete_route, data["message"])
+            route, source = parse_route(response.choices[0].message.content), "llm"
+        except Exception as e:
+            # The local answer is still usable.
+            logger.warning("Route fallback failed: %s", e)
+    return jsonify({"route": route, "confidence": round(confidence, 3), "source": source}), 200
+
+# Covers are loaded by <img> tags, which can't send the API key, so like /health this
+# route is public. It only serves the covers of Gutenberg books, not arbitrary URLs.
+@app.route("/covers/<int:book_id>")
+def cover(book_id):
+    width = request.args.get("w", 0, type=int)
+    if width and width not in COVER_WIDTHS:
+        abort(400, description=f"Bad Request: w must be one of {', '.join(map(str, COVER_WIDTHS))}")
+
+    try:
+        books = get_books_by_id([book_id])
+    except requests.exceptions.RequestException as e:
+        abort(500, description=f"Error querying Gutendex API: {e}")
+    if not books or not books[0].get("image"):
+        abort(404, description="Not Found: book has no cover")
+
+    try:
+        with stage_timer("cover"):
+            data, content_type = cover_store.get(books[0]["image"], width)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        abort(502, description=f"Error fetching cover image: {e}")
+    return cover_response(data, content_type, request.headers.get("If-None-Match"))
+
+
+def cover_response(data, content_type, if_none_match):
+    """
+    Returns the (body, status, headers) response for a cover, answering 304 Not Modified
+    when the client already has it.
+    """
+    etag = cover_etag(data)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={COVER_MAX_AGE}, immutable"}
+    if etag_matches(if_none_match, etag):
+        return b"", 304, headers
+    return data, 200, dict(headers, **{"Content-Type": content_type})
+
+@app.errorhandler(UpstreamError)
+def upstream_unavailable(e):
+    """
+    Answers 504 when an upstream timed out and 503 while its circuit is open, instead of
+    a generic 500.
+    """
+    if isinstance(e, CircuitOpenError):
+        return str(e), 503, {"Retry-After": str(math.ceil(e.retry_after))}
+    return str(e), 504 if isinstance(e, UpstreamTimeout) else 502
+
+@app.before_request
+def start_request_timing():
+    # Unmatched paths share one label, so scanners can't add a histogram series per URL.
+    start_request(request.endpoint or "unmatched")
+
+@app.after_request
+def finish_request_timing(response):
+    timings = current_request()
+    if timings is not None:
+        timings.finish(response.status_code)
+        response.headers["Server-Timing"] = timings.server_timing()
+        slow_request_log.maybe_log(timings, response.status_code)
+    return response
+
 @app.route('/health')
 def health():
     return "OK", 200
 
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({
+        "gutendex": gutendex_cache.stats(),
+        "translation": translation_cache.stats(),
+        "fast_path": fast_path.stats(),
+        "cover_images": cover_store.stats(),
+        "upstream": {
+            "gutendex": gutendex_upstream.stats(),
+            "openai": openai_upstream.stats(),
+            "openai_chat": openai_chat_upstream.stats()
+        },
+        "coalescing": {
+            "gutendex": gutendex_flight.stats(),
+            "translation": translation_flight.stats()
+        }
+    }), 200
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,660 @@
+"""
+Async variant of the /query_books, /query_books_graph and /chat routes.
+
+The Flask app in app.py blocks a worker thread for the whole OpenAI call and then the
+Gutendex call. This Quart app serves the same routes with AsyncOpenAI and a pooled
+httpx.AsyncClient, so a single process keeps hundreds of requests in flight. Run it with:
+
+    hypercorn async_app:app --bind 0.0.0.0:5000
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from functools import partial
+
+import httpx
+import requests
+from hypercorn.middleware import ProxyFixMiddleware
+from openai import APIError, AsyncOpenAI
+from quart import Quart, Response, request, jsonify, abort
+
+from app import (
+    BATCH_MAX_CONCURRENCY,
+    CHAT_SUMMARY_MODEL,
+    CHAT_SUMMARY_TOKENS,
+    CONTEXT_MAX_BOOKS,
+    COVER_BASE_URL,
+    COVER_WIDTHS,
+    EXPAND_MAX_IDS,
+    GUTENDEX_PREFETCH_PAGES,
+    GUTENDEX_URL,
+    MAX_BOOKS,
+    OPENAI_API_KEY,
+    OPENAI_TIMEOUT,
+    REQUIRED_API_KEY,
+    ROUTE_LLM_MODEL,
+    SSE_HEADERS,
+    SUMMARIES_MAX_IDS,
+    TRUSTED_PROXY_HOPS,
+    BookCollector,
+    build_chat_messages,
+    build_graph_from_books,
+    cache_metrics,
+    chat_done_event,
+    classify_route_locally,
+    cover_response,
+    cover_store,
+    fallback_query_params,
+    fast_path,
+    gutendex_cache,
+    gutendex_upstream,
+    id_query_params,
+    index_book,
+    insert_after_system,
+    known_books,
+    latest_user_text,
+    later_page_params,
+    local_catalog,
+    logger,
+    make_tidy_book,
+    merge_batch_graph,
+    openai_chat_upstream,
+    openai_upstream,
+    parse_batch_items,
+    parse_book_ids,
+    parse_edge_mode,
+    remember_books,
+    rewrite_pics,
+    search_passages,
+    slow_request_log,
+    split_chat,
+    sse_event,
+    summary_cache,
+    translation_cache,
+    upstream_unavailable,
+    wants_event_stream,
+    wants_slim,
+    wants_thumbnails
+)
+from book_index import context_message
+from cache import normalize_query_params
+from conversation import build_summary_messages
+from query_translation import build_translation_messages, normalize_user_text, parse_query_string
+from response_encoding import encode_payload, slim_payload
+from route_classifier import build_route_messages, parse_route
+from metrics import REGISTRY, current_request, stage_timer, start_request
+from singleflight import AsyncSingleFlight
+from upstream import UpstreamError
+
+app = Quart(__name__)
+if TRUSTED_PROXY_HOPS:
+    # hypercorn's counterpart of werkzeug's ProxyFix (X-Forwarded-For/-Proto/-Host).
+    app.asgi_app = ProxyFixMiddleware(app.asgi_app, trusted_hops=TRUSTED_PROXY_HOPS)
+
+# Connection pool and concurrency limits for the upstream services.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "64"))
+GUTENDEX_MAX_CONCURRENCY = int(os.getenv("GUTENDEX_MAX_CONCURRENCY", "32"))
+
+http_client = None
+async_client = None
+openai_semaphore = None
+gutendex_semaphore = None
+
+# Coalesce identical translations and Gutendex fetches that are in flight at the same time.
+translation_flight = AsyncSingleFlight()
+gutendex_flight = AsyncSingleFlight()
+# Report these groups at /metrics instead of app.py's, which this app doesn't use.
+REGISTRY.remove_collector(cache_metrics)
+REGISTRY.add_collector(partial(cache_metrics, {"gutendex": gutendex_flight, "translation": translation_flight}))
+# Background refreshes of stale Gutendex pages, referenced until they finish.
+revalidate_tasks = set()
+
+
+def _make_http_client():
+    return httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+    )
+
+
+@app.before_serving
+async def open_clients():
+    # Clients and semaphores are bound to the running event loop, so create them here.
+    global http_client, async_client, openai_semaphore, gutendex_semaphore
+    http_client = _make_http_client()
+    async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_make_http_client(), timeout=OPENAI_TIMEOUT,
+                               max_retries=0)
+    openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    gutendex_semaphore = asyncio.Semaphore(GUTENDEX_MAX_CONCURRENCY)
+
+
+@app.after_serving
+async def close_clients():
+    await http_client.aclose()
+    await async_client.close()
+
+
+async def translate_query(user_query):
+    """
+    Async counterpart of app.translate_query, sharing the same translation cache.
+    """
+    query_params = translation_cache.get(user_query)
+    if query_params is not None:
+        return query_params
+    with stage_timer("fast_path"):
+        query_params = fast_path.translate(user_query)
+    if query_params is not None:
+        return query_params
+    try:
+        query_params = await translation_flight.do(normalize_user_text(user_query), _translate_query_uncached, user_query)
+    except (UpstreamError, APIError) as e:
+        logger.warning("Query translation failed, falling back to the rule-based parse: %s", e)
+        return fallback_query_params(user_query)
+    return dict(query_params)
+
+
+async def _translate_query_uncached(user_query):
+    with stage_timer("llm_translation"):
+        response = await openai_upstream.call_async(_complete_translation, user_query, semaphore=openai_semaphore)
+    with stage_timer("query_postprocess"):
+        query_params = parse_query_string(response.choices[0].message.content)
+    translation_cache.set(user_query, query_params)
+    return query_params
+
+
+async def _complete_translation(timeout, user_query):
+    return await async_client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+        model="gpt-4o",
+        messages=build_translation_messages(user_query),
+        response_format={"type": "text"},
+        temperature=0.5,
+        max_completion_tokens=2048,
+        top_p=1,
+        frequency_penalty=0,
+        presence_penalty=0
+    )
+
+
+async def fetch_gutendex(query_params):
+    """
+    Async counterpart of app.fetch_gutendex, sharing the same response cache.
+    """
+    with stage_timer("gutendex_fetch"):
+        if local_catalog is not None:
+            return await asyncio.to_thread(local_catalog.query, query_params)
+        data = await gutendex_cache_call(gutendex_cache.get, query_params)
+        if data is not None:
+            return data
+        key = normalize_query_params(query_params)
+        data = await gutendex_cache_call(gutendex_cache.get_stale, query_params)
+        if data is not None:
+            task = asyncio.create_task(_revalidate_gutendex(key, query_params))
+            revalidate_tasks.add(task)
+            task.add_done_callback(revalidate_tasks.discard)
+            return data
+        return await gutendex_flight.do(key, _fetch_gutendex_uncached, query_params)
+
+
+async def gutendex_cache_call(method, *args):
+    """
+    Calls a gutendex_cache method. With GUTENDEX_CACHE_DIR set it reads and writes files
+    (and now and then prunes the directory), so it then runs on a worker thread.
+    """
+    if gutendex_cache.disk is None:
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+
+async def _revalidate_gutendex(key, query_params):
+    try:
+        await gutendex_flight.do(key, _fetch_gutendex_uncached, query_params)
+    except Exception as e:
+        logger.warning("Refreshing stale Gutendex page %s failed: %s", key, e)
+
+
+async def _fetch_gutendex_uncached(query_params):
+    data = await gutendex_upstream.call_async(_get_gutendex, query_params, semaphore=gutendex_semaphore)
+    await gutendex_cache_call(gutendex_cache.set, query_params, data)
+    return data
+
+
+async def _get_gutendex(timeout, query_params):
+    response = await http_client.get(GUTENDEX_URL, params=query_params, follow_redirects=True, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+async def get_tidy_books(query_params, n, exclude=()):
+    """
+    Async counterpart of app.get_tidy_books, prefetching later pages as concurrent tasks.
+    """
+    data = await fetch_gutendex(query_params)
+    collector = BookCollector(n, exclude)
+    with stage_timer("tidy"):
+        done = collector.add_results(data.get("results", []))
+    if done:
+        return remember_books(collector.books)
+
+    pages = iter(later_page_params(query_params, data))
+    window = deque()
+
+    def prefetch_next_page():
+        params = next(pages, None)
+        if params is not None:
+            window.append(asyncio.create_task(fetch_gutendex(params)))
+
+    for _ in range(GUTENDEX_PREFETCH_PAGES):
+        prefetch_next_page()
+    try:
+        while window:
+            data = await window.popleft()
+            prefetch_next_page()
+            with stage_timer("tidy"):
+                done = collector.add_results(data.get("results", []))
+            if done:
+                break
+    finally:
+        for task in window:
+            task.cancel()
+    return remember_books(collector.books)
+
+
+async def get_books_by_id(book_ids):
+    """
+    Async counterpart of app.get_books_by_id, sharing the same known_books cache.
+    """
+    missing = [book_id for book_id in book_ids if known_books.get(book_id) is None]
+    pages = await asyncio.gather(*(fetch_gutendex(params) for params in id_query_params(missing)))
+    for data in pages:
+        remember_books([make_tidy_book(book) for book in data.get("results", [])])
+    books = (known_books.get(book_id) for book_id in book_ids)
+    return [book for book in books if book is not None]
+
+
+def check_api_key():
+    api_key = request.headers.get("Authorization")
+    if not api_key or api_key != f"Bearer {REQUIRED_API_KEY}":
+        abort(401, description="Unauthorized: Invalid or missing API key")
+
+
+def payload_response(payload, slim=False):
+    """
+    Async counterpart of app.payload_response.
+    """
+    with stage_timer("serialize"):
+        if slim:
+            payload = slim_payload(payload)
+        body, headers = encode_payload(payload, request.headers.get("Accept"), request.headers.get("Accept-Encoding"))
+    return Response(body, status=200, headers=headers)
+
+
+@app.route("/query_books", methods=["POST"])
+async def query_books():
+    data = await request.get_json()
+    if not data or "query" not in data:
+        abort(400, description="Bad Request: No query parameter provided")
+    check_api_key()
+
+    slim = wants_slim(data, request.args)
+    query_params = await translate_query(data["query"])
+    try:
+        data = await fetch_gutendex(query_params)
+    except httpx.HTTPError as e:
+        abort(500, description=f"Error querying Gutendex API: {e}")
+
+    with stage_timer("tidy"):
+        tidy_books = [make_tidy_book(book) for book in data.get("results", [])]
+    return payload_response({"count": data.get("count", 0), "results": tidy_books}, slim=slim)
+
+
+@app.route("/query_books_graph", methods=["POST"])
+async def query_books_graph():
+    data = await request.get_json()
+    if not data or "query" not in data:
+        abort(400, description="Bad Request: No query parameter provided")
+    check_api_key()
+
+    # Retrieve the 'n' parameter, defaulting to 10 if not provided.
+    n = data.get("n", 10)
+    try:
+        n = int(n)
+    except ValueError:
+        abort(400, description="Bad Request: n must be an integer")
+    if n < 1:
+        abort(400, description="Bad Request: n must be at least 1")
+    if n > MAX_BOOKS:
+        abort(400, description=f"Bad Request: n must be at most {MAX_BOOKS}")
+
+    # Expansion mode: the Gutenberg IDs already in the client's graph.
+    try:
+        existing_ids = parse_book_ids(data.get("existing_ids", []))
+        edge_mode = parse_edge_mode(data)
+    except ValueError as e:
+        abort(400, description=f"Bad Request: {e}")
+    if len(existing_ids) > EXPAND_MAX_IDS:
+        abort(400, description=f"Bad Request: at most {EXPAND_MAX_IDS} existing_ids are allowed")
+
+    query_params = await translate_query(data["query"])
+    try:
+        existing_books = await get_books_by_id(existing_ids) if existing_ids else []
+        tidy_books = await get_tidy_books(query_params, n, exclude=existing_books)
+    except httpx.HTTPError as e:
+        abort(500, description=f"Error querying Gutendex API: {e}")
+    # Building the edges is CPU-bound (about a second for thousands of similarity edges),
+    # so it runs on a worker thread instead of stalling the event loop.
+    graph = await asyncio.to_thread(build_graph_from_books, tidy_books, existing_books=existing_books,
+                                    edge_mode=edge_mode)
+    if wants_thumbnails(data, request.args):
+        rewrite_pics(graph, COVER_BASE_URL or request.url_root)
+    return payload_response(graph, slim=wants_slim(data, request.args))
+
+
+@app.route("/query_books_graph_batch", methods=["POST"])
+async def query_books_graph_batch():
+    data = await request.get_json()
+    if not data or "queries" not in data:
+        abort(400, description="Bad Request: No queries provided")
+    check_api_key()
+
+    try:
+        items = parse_batch_items(data)
+        edge_mode = parse_edge_mode(data)
+    except ValueError as e:
+        abort(400, description=f"Bad Request: {e}")
+
+    semaphore = asyncio.Semaphore(max(BATCH_MAX_CONCURRENCY, 1))
+
+    async def run_batch_item(item):
+        async with semaphore:
+            return await get_tidy_books(await translate_query(item["query"]), item["n"])
+
+    outcomes = await asyncio.gather(*(run_batch_item(item) for item in items), return_exceptions=True)
+    for item, outcome in zip(items, outcomes):
+        if isinstance(outcome, Exception):
+            logger.warning("Batch query %r failed: %s", item["query"], outcome)
+    if all(isinstance(outcome, Exception) for outcome in outcomes):
+        abort(500, description=f"Error processing batch: {outcomes[0]}")
+
+    graph = await asyncio.to_thread(merge_batch_graph, items, outcomes, edge_mode)
+    if wants_thumbnails(data, request.args):
+        rewrite_pics(graph, COVER_BASE_URL or request.url_root)
+    return payload_response(graph, slim=wants_slim(data, request.args))
+
+
+@app.route("/book_summaries", methods=["POST"])
+async def book_summaries():
+    data = await request.get_json()
+    if not data or "ids" not in data:
+        abort(400, description="Bad Request: No ids provided")
+    check_api_key()
+
+    try:
+        book_ids = parse_book_ids(data["ids"])
+    except ValueError as e:
+        abort(400, description=f"Bad Request: {e}")
+    if len(book_ids) > SUMMARIES_MAX_IDS:
+        abort(400, description=f"Bad Request: at most {SUMMARIES_MAX_IDS} ids are allowed")
+
+    try:
+        books = await get_books_by_id(book_ids)
+    except httpx.HTTPError as e:
+        abort(500, description=f"Error querying Gutendex API: {e}")
+    return payload_response({"summaries": {str(book["id"]): book.get("summary") for book in books}})
+
+
+async def stream_chat_events(formatted_messages, started_at):
+    """
+    Async counterpart of app.stream_chat_events. The completion is requested from inside
+    the generator so the OpenAI concurrency slot is only taken once the body is iterated,
+    and is given back however the stream ends, including a client disconnect.
+    """
+    first_token_at = None
+    usage = None
+    async with openai_semaphore:
+        try:
+            # The slot is already held for the whole stream, so none is passed here.
+            with stage_timer("llm_chat"):
+                stream = await openai_chat_upstream.call_async(_complete_chat, formatted_messages, True)
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage.model_dump()
+                for choice in chunk.choices:
+                    token = choice.delta.content
+                    if token:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        yield sse_event("token", {"text": token})
+        except Exception as e:
+            yield sse_event("error", {"message": f"Error processing chat: {e}"})
+            return
+    yield chat_done_event(usage, started_at, first_token_at)
+
+
+async def compact_conversation(conversation):
+    """
+    Async counterpart of app.compact_conversation, sharing the same summary cache.
+    """
+    system, folded, recent = split_chat(conversation)
+    if not folded:
+        return conversation, None
+    summary = summary_cache.get(folded)
+    if summary is None:
+        previous_summary, turns = summary_cache.latest(folded)
+        try:
+            with stage_timer("chat_compaction"):
+                response = await openai_chat_upstream.call_async(
+                    _complete_summary, previous_summary, turns, semaphore=openai_semaphore
+                )
+        except Exception as e:
+            # Compaction only saves tokens, so it mustn't fail the turn: send the recent
+            # turns with the last summary there is (if any) instead.
+            logger.warning("Summarizing the conversation failed, truncating it instead: %s", e)
+            return system + recent, previous_summary
+        summary = response.choices[0].message.content.strip()
+        summary_cache.set(folded, summary)
+    return system + recent, summary
+
+
+async def _complete_summary(timeout, previous_summary, turns):
+    return await async_client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+        model=CHAT_SUMMARY_MODEL,
+        messages=build_summary_messages(previous_summary, turns),
+        response_format={"type": "text"},
+        temperature=0,
+        max_completion_tokens=CHAT_SUMMARY_TOKENS
+    )
+
+
+async def _complete_chat(timeout, formatted_messages, stream):
+    return await async_client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+        model="gpt-4o",
+        messages=formatted_messages,
+        response_format={"type": "text"},
+        temperature=0.5,
+        max_completion_tokens=2048,
+        top_p=1,
+        frequency_penalty=0,
+        presence_penalty=0,
+        **({"stream": True, "stream_options": {"include_usage": True}} if stream else {})
+    )
+
+
+async def chat_reply(formatted_messages, stream, started_at):
+    """
+    Async counterpart of app.chat_reply. Streamed replies report upstream errors as an
+    "error" event, since the request is only sent once the response body is iterated.
+    """
+    if stream:
+        return Response(stream_chat_events(formatted_messages, started_at), mimetype="text/event-stream",
+                        headers=SSE_HEADERS)
+    try:
+        with stage_timer("llm_chat"):
+            response = await openai_chat_upstream.call_async(
+                _complete_chat, formatted_messages, False, semaphore=openai_semaphore
+            )
+    except UpstreamError:
+        raise
+    except Exception as e:
+        abort(500, description=f"Error processing chat: {e}")
+    return jsonify(response.choices[0].message.content), 200
+
+
+@app.route("/chat", methods=["POST"])
+async def chat():
+    data = await request.get_json()
+    if not data or "messages" not in data:
+        abort(400, description="Bad Request: No messages provided in the request body")
+    check_api_key()
+
+    stream = wants_event_stream(data, request.headers.get("Accept"))
+    started_at = time.perf_counter()
+    try:
+        formatted_messages = build_chat_messages(*await compact_conversation(data["messages"]))
+    except Exception as e:
+        abort(500, description=f"Error processing chat: {e}")
+    return await chat_reply(formatted_messages, stream, started_at)
+
+
+@app.route("/context_chat", methods=["POST"])
+async def context_chat():
+    data = await request.get_json()
+    if not data or "messages" not in data:
+        abort(400, description="Bad Request: No messages provided in the request body")
+    check_api_key()
+
+    try:
+        book_ids = parse_book_ids(data.get("gutindex_ids", []))
+    except ValueError as e:
+        abort(400, description=f"Bad Request: {e}")
+    if len(book_ids) > CONTEXT_MAX_BOOKS:
+        abort(400, description=f"Bad Request: at most {CONTEXT_MAX_BOOKS} gutindex_ids are allowed")
+
+    stream = wants_event_stream(data, request.headers.get("Accept"))
+    started_at = time.perf_counter()
+    try:
+        books = await get_books_by_id(book_ids) if book_ids else []
+        # Downloading and indexing a book blocks, so it runs on a worker thread.
+        with stage_timer("book_index"):
+            indexes = await asyncio.gather(*(asyncio.to_thread(index_book, book) for book in books))
+        hits = search_passages(books, indexes, latest_user_text(data["messages"]))
+        formatted_messages = build_chat_messages(*await compact_conversation(data["messages"]))
+        if books:
+            insert_after_system(formatted_messages, context_message(books, hits))
+    except Exception as e:
+        abort(500, description=f"Error processing chat: {e}")
+    return await chat_reply(formatted_messages, stream, started_at)
+
+
+async def _complete_route(timeout, message):
+    return await async_client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+        model=ROUTE_LLM_MODEL,
+        messages=build_route_messages(message),
+        response_format={"type": "text"},
+        temperature=0,
+        max_completion_tokens=8
+    )
+
+
+@app.route("/classify_route", methods=["POST"])
+async def classify_route():
+    data = await request.get_json()
+    if not data or "message" not in data:
+        abort(400, description="Bad Request: No message provided in the request body")
+    check_api_key()
+
+    route, confidence, needs_fallback = classify_route_locally(data["message"])
+    source = "local"
+    if needs_fallback:
+        try:
+            with stage_timer("llm_route"):
+                response = await openai_upstream.call_async(_complete_route, data["message"], semaphore=openai_semaphore)
+            route, source = parse_route(response.choices[0].message.content), "llm"
+        except Exception as e:
+            # The local answer is still usable.
+            logger.warning("Route fallback failed: %s", e)
+    return jsonify({"route": route, "confidence": round(confidence, 3), "source": source}), 200
+
+
+# Public like app.cover: <img> tags can't send the API key.
+@app.route("/covers/<int:book_id>")
+async def cover(book_id):
+    width = request.args.get("w", 0, type=int)
+    if width and width not in COVER_WIDTHS:
+        abort(400, description=f"Bad Request: w must be one of {', '.join(map(str, COVER_WIDTHS))}")
+
+    try:
+        books = await get_books_by_id([book_id])
+    except httpx.HTTPError as e:
+        abort(500, description=f"Error querying Gutendex API: {e}")
+    if not books or not books[0].get("image"):
+        abort(404, description="Not Found: book has no cover")
+
+    try:
+        with stage_timer("cover"):
+            data, content_type = await asyncio.to_thread(cover_store.get, books[0]["image"], width)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        abort(502, description=f"Error fetching cover image: {e}")
+    return cover_response(data, content_type, request.headers.get("If-None-Match"))
+
+
+@app.errorhandler(UpstreamError)
+async def handle_upstream_error(e):
+    return upstream_unavailable(e)
+
+
+@app.before_request
+async def start_request_timing():
+    # Unmatched paths share one label, so scanners can't add a histogram series per URL.
+    start_request(request.endpoint or "unmatched")
+
+
+@app.after_request
+async def finish_request_timing(response):
+    timings = current_request()
+    if timings is not None:
+        timings.finish(response.status_code)
+        response.headers["Server-Timing"] = timings.server_timing()
+        slow_request_log.maybe_log(timings, response.status_code)
+    return response
+
+
+@app.route('/health')
+async def health():
+    return "OK", 200
+
+
+@app.route('/metrics')
+async def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/cache_stats')
+async def cache_stats():
+    return jsonify({
+        "gutendex": gutendex_cache.stats(),
+        "translation": translation_cache.stats(),
+        "fast_path": fast_path.stats(),
+        "cover_images": cover_store.stats(),
+        "upstream": {
+            "gutendex": gutendex_upstream.stats(),
+            "openai": openai_upstream.stats(),
+            "openai_chat": openai_chat_upstream.stats()
+        },
+        "coalescing": {
+            "gutendex": gutendex_flight.stats(),
+            "translation": translation_flight.stats()
+        }
+    }), 200
+
+
+if __name__ == "__main__":
+    app.run()
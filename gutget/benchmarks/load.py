@@ -0,0 +1,198 @@
+"""
+Load/latency benchmark for /query_books, /query_books_graph and /chat.
+
+Starts the local OpenAI and Gutendex stand-ins, launches the backend against them and
+drives the endpoints at a fixed concurrency, reporting p50/p95/p99 latency and
+throughput. Run from the gutget directory:
+
+    python -m benchmarks.load --server flask --concurrency 32 --requests 300
+    python -m benchmarks.load --server async --endpoint chat --stream
+    python -m benchmarks.load --target http://127.0.0.1:5000   # an already running server
+
+With --target the server must already be pointed at the stand-ins (see standins.py).
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.standins import TOPICS, add_latency_arguments, start_standins
+
+API_KEY = "benchmark-key"
+ENDPOINTS = ("query_books", "query_books_graph", "chat")
+GUTGET_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, env):
+    """
+    Launches the backend in a subprocess and waits for /health to answer.
+    """
+    if kind == "flask":
+        command = [sys.executable, "-c", f"import app; app.app.run(port={port}, threaded=True)"]
+    elif kind == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-w", "4", "-b", f"127.0.0.1:{port}", "app:app"]
+    else:
+        command = [sys.executable, "-m", "hypercorn", "-b", f"127.0.0.1:{port}", "async_app:app"]
+    process = subprocess.Popen(
+        command, cwd=GUTGET_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except requests.exceptions.RequestException:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+def make_payload(endpoint, i, args):
+    topic = TOPICS[i % len(TOPICS)]
+    # A per-request suffix defeats the translation cache when measuring cold paths.
+    query = f"Give me {topic.lower()} books" + (f" #{i}" if args.unique_queries else "")
+    if endpoint == "chat":
+        payload = {"messages": [{"role": "user", "text": f"Tell me about {topic.lower()} on Project Gutenberg"}]}
+        if args.stream:
+            payload["stream"] = True
+        return payload
+    if endpoint == "query_books_graph":
+        return {"query": query, "n": args.n}
+    return {"query": query}
+
+
+def run_endpoint(url, endpoint, args):
+    """
+    Sends args.requests requests to one endpoint with args.concurrency in flight and
+    returns a summary of latencies and throughput.
+    """
+    local = threading.local()
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+
+    def send(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        first_byte = None
+        try:
+            response = session.post(f"{url}/{endpoint}", json=make_payload(endpoint, i, args), headers=headers, stream=True)
+            for chunk in response.iter_content(chunk_size=None):
+                if first_byte is None and chunk:
+                    first_byte = time.perf_counter()
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        end = time.perf_counter()
+        return ok, end - start, (first_byte or end) - start
+
+    for i in range(args.warmup):
+        send(i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(send, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for ok, latency, _ in results if ok)
+    first_bytes = sorted(first_byte for ok, _, first_byte in results if ok)
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "endpoint": endpoint,
+        "requests": len(results),
+        "errors": sum(1 for ok, _, _ in results if not ok),
+        "concurrency": args.concurrency,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "ttfb_p50_ms": ms(percentile(first_bytes, 0.50))
+    }
+
+
+def print_table(rows):
+    columns = ["endpoint", "requests", "errors", "concurrency", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "ttfb_p50_ms"]
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load/latency benchmark for the gutget backend")
+    parser.add_argument("--server", choices=["flask", "gunicorn", "async"], default="flask")
+    parser.add_argument("--target", help="Benchmark an already running server instead of launching one")
+    parser.add_argument("--endpoint", choices=ENDPOINTS + ("all",), default="all")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--n", type=int, default=10, help="Books per /query_books_graph request")
+    parser.add_argument("--stream", action="store_true", help="Request streamed /chat replies")
+    parser.add_argument("--unique-queries", action="store_true", help="Make every query distinct")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the backend's response and translation caches and the fast-path parser")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    add_latency_arguments(parser)
+    args = parser.parse_args(argv)
+
+    process = None
+    url = args.target
+    if not url:
+        openai_url, gutendex_url = start_standins(args)
+        env = dict(
+            os.environ,
+            OPENAI_BASE_URL=openai_url,
+            OPENAI_API_KEY="stand-in",
+            GUTENDEX_URL=gutendex_url,
+            REQUIRED_API_KEY=API_KEY
+        )
+        if args.no_cache:
+            env.update(GUTENDEX_CACHE_SIZE="0", TRANSLATION_CACHE_SIZE="0", FAST_PATH_THRESHOLD="2")
+            env.pop("GUTENDEX_CACHE_DIR", None)
+        process, url = start_server(args.server, free_port(), env)
+
+    try:
+        endpoints = ENDPOINTS if args.endpoint == "all" else (args.endpoint,)
+        rows = [run_endpoint(url, endpoint, args) for endpoint in endpoints]
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
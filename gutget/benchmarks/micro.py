@@ -0,0 +1,90 @@
+"""
+In-process benchmarks for get_tidy_books and build_graph_from_books (with attribute and
+similarity edges) at 10 to 10,000 books.
+
+get_tidy_books runs against the local Gutendex stand-in (with the response cache
+disabled), so it measures page fetching, tidying and deduplication. Run from the
+gutget directory:
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --sizes 10 100 1000 --gutendex-latency-ms 50
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from benchmarks.standins import Latency, make_gutendex_server, serve_in_background, synthetic_books
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+
+def timed(fn, repeat):
+    """
+    Runs fn repeat times and returns the timings in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(name, size, timings):
+    return {
+        "benchmark": name,
+        "books": size,
+        "runs": len(timings),
+        "median_ms": round(statistics.median(timings), 2),
+        "min_ms": round(min(timings), 2),
+        "max_ms": round(max(timings), 2)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="get_tidy_books / build_graph_from_books benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--gutendex-latency-ms", type=float, default=0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    books = synthetic_books(max(args.sizes))
+    server = make_gutendex_server(latency=Latency(args.gutendex_latency_ms), books=books)
+    # The app reads its configuration at import time.
+    os.environ["GUTENDEX_URL"] = serve_in_background(server) + "/books"
+    os.environ["GUTENDEX_CACHE_SIZE"] = "0"
+    os.environ.pop("GUTENDEX_CACHE_DIR", None)
+    os.environ.pop("CATALOG_DB", None)
+    os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+    import app
+
+    rows = []
+    for size in args.sizes:
+        tidy_books = []
+
+        def run_tidy():
+            tidy_books[:] = app.get_tidy_books({}, size)
+
+        rows.append(summarize("get_tidy_books", size, timed(run_tidy, args.repeat)))
+        rows.append(summarize(
+            "build_graph_from_books", size, timed(lambda: app.build_graph_from_books(tidy_books), args.repeat)
+        ))
+        # The first run fills the book vector cache; the median is the cached case.
+        rows.append(summarize("similarity_graph", size, timed(
+            lambda: app.build_graph_from_books(tidy_books, edge_mode="similarity"), args.repeat
+        )))
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'benchmark':<24}{'books':>8}{'median_ms':>12}{'min_ms':>10}{'max_ms':>10}")
+    for row in rows:
+        print(f"{row['benchmark']:<24}{row['books']:>8}{row['median_ms']:>12}{row['min_ms']:>10}{row['max_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+Local stand-ins for the OpenAI chat completions API and the Gutendex /books API, with
+configurable injected latency, so the backend can be benchmarked without network access.
+
+    python -m benchmarks.standins --openai-port 8101 --gutendex-port 8102 \
+        --openai-latency-ms 800 --gutendex-latency-ms 300
+
+Point the backend at them with OPENAI_BASE_URL=http://127.0.0.1:8101/v1 and
+GUTENDEX_URL=http://127.0.0.1:8102/books.
+
+The Gutendex stand-in serves pages from a deterministic synthetic catalog by default.
+Recorded Gutendex data can be served instead with --catalog (a JSON list of Gutendex book
+objects, e.g. the concatenated "results" of saved pages) or --catalog-db (a database
+built with catalog.py). With --local-covers the synthetic books' cover URLs point at the
+stand-in, which serves a generated PNG for each of them, so the /covers proxy can be
+exercised offline.
+"""
+import argparse
+import functools
+import json
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from catalog import Catalog
+
+PAGE_SIZE = 32
+
+TOPICS = [
+    "Gothic Fiction", "Children's Literature", "Science Fiction", "Detective Fiction",
+    "Poetry", "Philosophy", "History", "Adventure", "Romance", "Horror tales",
+    "Humor", "Travel", "Plays", "Mythology", "Fairy tales"
+]
+LANGUAGES = ["en"] * 8 + ["fr", "de"]
+CHAT_REPLY = (
+    "Here are a few books you might enjoy. Each of them is available for free on Project "
+    "Gutenberg and is a good starting point for exploring the topic you asked about."
+)
+
+
+def synthetic_books(count, seed=42):
+    """
+    Generates a deterministic list of Gutendex-shaped book objects.
+    """
+    rng = random.Random(seed)
+    authors = [
+        {"name": f"Author{i}, Writer", "birth_year": 1700 + i % 250, "death_year": 1760 + i % 250}
+        for i in range(max(count // 4, 1))
+    ]
+    books = []
+    for book_id in range(1, count + 1):
+        topics = rng.sample(TOPICS, 2)
+        books.append({
+            "id": book_id,
+            "title": f"Book {book_id}: A Tale of {topics[0]}",
+            "authors": [rng.choice(authors)],
+            "summaries": [f"A synthetic summary of book {book_id} about {topics[0].lower()} and {topics[1].lower()}."],
+            "translators": [],
+            "subjects": [f"{topic} -- Fiction" for topic in topics],
+            "bookshelves": [topics[0]],
+            "languages": [rng.choice(LANGUAGES)],
+            "copyright": False,
+            "media_type": "Text",
+            "formats": {
+                "image/jpeg": f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}.cover.medium.jpg",
+                "application/zip": f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}-h.zip"
+            },
+            "download_count": count - book_id
+        })
+    return books
+
+
+@functools.lru_cache(maxsize=256)
+def synthetic_cover(book_id, width=200, height=300):
+    """
+    Generates a deterministic noisy PNG cover for a book, about the size of a Gutenberg
+    "medium" cover.
+    """
+    rng = random.Random(book_id)
+    base = rng.randrange(0, 192)
+    shades = bytes(min(base + byte % 8, 255) for byte in range(256))
+    rows = b"".join(b"\0" + rng.randbytes(width * 3).translate(shades) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+class BookList:
+    """
+    Answers Gutendex queries over an in-memory list of books (topic, search, languages,
+    ids and sort; other parameters are ignored).
+    """
+
+    def __init__(self, books):
+        self.books = sorted(books, key=lambda book: -book.get("download_count", 0))
+
+    def query(self, params):
+        params = dict(params)
+        page = int(params.pop("page", 1) or 1)
+        books = self.books
+        topic = params.get("topic", "").lower()
+        if topic:
+            books = [b for b in books if any(topic in s.lower() for s in b["subjects"] + b["bookshelves"])]
+        for word in params.get("search", "").lower().split():
+            books = [
+                b for b in books
+                if word in b["title"].lower() or any(word in a["name"].lower() for a in b["authors"])
+            ]
+        languages = [code for code in params.get("languages", "").split(",") if code]
+        if languages:
+            books = [b for b in books if set(b["languages"]) & set(languages)]
+        ids = [int(i) for i in params.get("ids", "").split(",") if i.strip().isdigit()]
+        if ids:
+            books = [b for b in books if b["id"] in ids]
+        if params.get("sort") in ("ascending", "descending"):
+            books = sorted(books, key=lambda b: b["id"], reverse=params["sort"] == "descending")
+        start = (page - 1) * PAGE_SIZE
+        return {
+            "count": len(books),
+            "next": "?" + urlencode(dict(params, page=page + 1)) if start + PAGE_SIZE < len(books) else None,
+            "previous": "?" + urlencode(dict(params, page=page - 1)) if page > 1 else None,
+            "results": books[start:start + PAGE_SIZE]
+        }
+
+
+class Latency:
+    """
+    Injected latency: a base delay in milliseconds with +/- jitter (as a fraction). A
+    tail_rate fraction of the delays are tail_ms long instead, to simulate a degraded
+    upstream.
+    """
+
+    def __init__(self, ms=0.0, jitter=0.0, seed=None, tail_ms=0.0, tail_rate=0.0):
+        self.ms = ms
+        self.jitter = jitter
+        self.tail_ms = tail_ms
+        self.tail_rate = tail_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self, scale=1.0):
+        with self._lock:
+            factor = 1 + self._rng.uniform(-self.jitter, self.jitter)
+            tail = self.tail_rate > 0 and self._rng.random() < self.tail_rate
+        ms = self.tail_ms if tail else self.ms
+        if ms > 0:
+            time.sleep(ms * scale * factor / 1000)
+
+
+class StandInServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients hang up on slow responses when they time out or a hedged request wins.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, Nagle's algorithm adds ~40 ms.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_image(self, body, content_type="image/png"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class GutendexHandler(StandInHandler):
+    # Set by make_gutendex_server.
+    book_list = None
+    latency = None
+
+    COVER_PATH = re.compile(r"^/cache/epub/(\d+)/[^/]+\.cover\.\w+\.jpg$")
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        cover = self.COVER_PATH.match(url.path)
+        if cover:
+            self.latency.sleep()
+            self.send_image(synthetic_cover(int(cover.group(1))))
+            return
+        if url.path.rstrip("/") != "/books":
+            self.send_json({"detail": "Not found."}, status=404)
+            return
+        self.latency.sleep()
+        self.send_json(self.book_list.query(dict(parse_qsl(url.query))))
+
+
+def canned_translation(user_text):
+    """
+    Returns a canned Gutendex query string for a natural-language request.
+    """
+    text = user_text.lower()
+    for topic in TOPICS:
+        keyword = topic.split()[0].lower().replace("'s", "")
+        if keyword in text:
+            return "/books?" + urlencode({"topic": keyword, "languages": "en"})
+    return "/books?languages=en"
+
+
+class OpenAIHandler(StandInHandler):
+    # Set by make_openai_server.
+    latency = None
+    token_latency = None
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json({"error": {"message": "Not found"}}, status=404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        messages = body.get("messages", [])
+        system_text = json.dumps([m for m in messages if m.get("role") == "system"])
+        last = messages[-1] if messages else {}
+        content = last.get("content", "")
+        user_text = content if isinstance(content, str) else " ".join(part.get("text", "") for part in content)
+        if "gutindex API" in system_text:
+            reply = canned_translation(user_text)
+        else:
+            reply = CHAT_REPLY
+        usage = {
+            "prompt_tokens": len(json.dumps(messages)) // 4,
+            "completion_tokens": len(reply) // 4,
+            "total_tokens": (len(json.dumps(messages)) + len(reply)) // 4
+        }
+
+        self.latency.sleep()
+        if body.get("stream"):
+            self.stream_reply(reply, usage, body)
+            return
+        self.send_json({
+            "id": "chatcmpl-standin",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def stream_reply(self, reply, usage, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(choices, chunk_usage=None):
+            chunk = {
+                "id": "chatcmpl-standin",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o"),
+                "choices": choices,
+                "usage": chunk_usage
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for word in reply.split(" "):
+            send_chunk([{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}])
+            self.token_latency.sleep()
+        send_chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send_chunk([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def make_gutendex_server(port=0, latency=None, books=None, catalog_db=None, host="127.0.0.1", local_covers=False):
+    """
+    Creates the Gutendex stand-in. With local_covers, the image/jpeg URLs of the served
+    books point at the stand-in itself instead of gutenberg.org.
+    """
+    book_list = Catalog(catalog_db) if catalog_db else BookList(books or synthetic_books(5000))
+    handler = type("Handler", (GutendexHandler,), {"book_list": book_list, "latency": latency or Latency()})
+    server = StandInServer((host, port), handler)
+    if local_covers and isinstance(book_list, BookList):
+        base_url = "http://%s:%s" % server.server_address[:2]
+        for book in book_list.books:
+            cover_url = book.get("formats", {}).get("image/jpeg")
+            if cover_url:
+                book["formats"]["image/jpeg"] = base_url + urlsplit(cover_url).path
+    return server
+
+
+def make_openai_server(port=0, latency=None, token_latency=None, host="127.0.0.1"):
+    handler = type("Handler", (OpenAIHandler,), {
+        "latency": latency or Latency(),
+        "token_latency": token_latency or Latency()
+    })
+    return StandInServer((host, port), handler)
+
+
+def serve_in_background(server):
+    """
+    Runs a server on a daemon thread and returns its base URL.
+    """
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def add_latency_arguments(parser):
+    parser.add_argument("--openai-latency-ms", type=float, default=800, help="Delay before each completion starts")
+    parser.add_argument("--openai-token-latency-ms", type=float, default=20, help="Delay between streamed tokens")
+    parser.add_argument("--gutendex-latency-ms", type=float, default=300, help="Delay for each Gutendex page")
+    parser.add_argument("--gutendex-tail-ms", type=float, default=0, help="Delay of the slow Gutendex responses")
+    parser.add_argument("--gutendex-tail-rate", type=float, default=0, help="Fraction of Gutendex responses that are slow")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative +/- jitter applied to every delay")
+    parser.add_argument("--catalog-size", type=int, default=5000, help="Number of synthetic books served")
+    parser.add_argument("--catalog", help="JSON list of recorded Gutendex book objects to serve")
+    parser.add_argument("--catalog-db", help="Catalog database built with catalog.py to serve")
+    parser.add_argument("--local-covers", action="store_true", help="Serve generated covers from the Gutendex stand-in")
+
+
+def start_standins(args, openai_port=0, gutendex_port=0):
+    """
+    Starts both stand-ins from parsed command-line arguments and returns
+    (openai_base_url, gutendex_url).
+    """
+    books = None
+    if args.catalog:
+        with open(args.catalog, "r", encoding="utf-8") as f:
+            books = json.load(f)
+    elif not args.catalog_db:
+        books = synthetic_books(args.catalog_size)
+    gutendex = make_gutendex_server(
+        gutendex_port,
+        latency=Latency(args.gutendex_latency_ms, args.jitter, tail_ms=args.gutendex_tail_ms, tail_rate=args.gutendex_tail_rate),
+        books=books,
+        catalog_db=args.catalog_db,
+        local_covers=args.local_covers
+    )
+    openai = make_openai_server(
+        openai_port,
+        latency=Latency(args.openai_latency_ms, args.jitter),
+        token_latency=Latency(args.openai_token_latency_ms, args.jitter)
+    )
+    return serve_in_background(openai) + "/v1", serve_in_background(gutendex) + "/books"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local OpenAI and Gutendex stand-ins")
+    parser.add_argument("--openai-port", type=int, default=8101)
+    parser.add_argument("--gutendex-port", type=int, default=8102)
+    add_latency_arguments(parser)
+    args = parser.parse_args(argv)
+
+    openai_url, gutendex_url = start_standins(args, args.openai_port, args.gutendex_port)
+    print(f"OPENAI_BASE_URL={openai_url}")
+    print(f"GUTENDEX_URL={gutendex_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""
+Full-text passage retrieval over Project Gutenberg books for /context_chat.
+
+A book's download (a zip holding its text or HTML, or a plain file) is decompressed and
+split into overlapping passages as a stream, without reading the whole book into memory.
+The passages get a BM25 index that is written to disk once per book:
+
+    <directory>/<id>.v1/meta.json      vocabulary (term -> postings start, document frequency)
+                        postings.bin   (passage, term frequency) uint32 pairs, grouped by term
+                        lengths.bin    uint32 token count of each passage
+                        offsets.bin    uint64 byte offset of each passage in passages.bin
+                        passages.bin   UTF-8 passage text
+
+The binary files are memory-mapped, so an index is reused across requests and processes
+without being loaded, and a search only touches the postings of the query's terms.
+"""
+import array
+import heapq
+import io
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+import requests
+
+from cache import LRUCache
+from singleflight import SingleFlight
+
+INDEX_VERSION = 1
+
+STOPWORDS = frozenset(
+    "a about above after again against all am an and any are as at be because been before being below "
+    "between both but by can could did do does doing down during each few for from further had has have "
+    "having he her here hers herself him himself his how i if in into is it its itself just me more most "
+    "my myself no nor not now of off on once only or other our ours ourselves out over own same she "
+    "should so some such than that the their theirs them themselves then there these they this those "
+    "through to too under until up very was we were what when where which while who whom why will with "
+    "would you your yours yourself yourselves tell book books".split()
+)
+TOKEN = re.compile(r"[a-z0-9]+")
+
+START_MARKER = re.compile(r"\*\*\*\s*START OF (?:THE|THIS) PROJECT GUTENBERG", re.IGNORECASE)
+END_MARKER = re.compile(r"\*\*\*\s*END OF (?:THE|THIS) PROJECT GUTENBERG", re.IGNORECASE)
+# How far into a book to look for the START marker before treating it as text without one.
+HEADER_LINES = 500
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+
+class _HTMLText(HTMLParser):
+    """
+    Collects the text of an HTML document fed to it piece by piece, with a line break
+    for each block element.
+    """
+
+    BLOCK_TAGS = {"p", "div", "br", "h1", "h2", "h3", "h4", "h5", "h6", "li", "tr", "pre", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skipping = max(self._skipping - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+    def take(self):
+        text = "".join(self.parts)
+        self.parts.clear()
+        return text
+
+
+def iter_text_lines(stream, is_html):
+    """
+    Yields the lines of a book from a binary stream of its plain text or HTML, decoding
+    (and stripping tags) incrementally.
+    """
+    reader = io.TextIOWrapper(stream, encoding="utf-8", errors="replace")
+    if not is_html:
+        yield from reader
+        return
+    parser = _HTMLText()
+    pending = ""
+    for piece in iter(lambda: reader.read(65536), ""):
+        parser.feed(piece)
+        *lines, pending = (pending + parser.take()).split("\n")
+        yield from lines
+    parser.close()
+    yield from (pending + parser.take()).split("\n")
+
+
+def iter_body_lines(lines):
+    """
+    Drops the Project Gutenberg header before the "*** START OF" marker and everything
+    from the "*** END OF" marker on. Text without a START marker is passed through whole.
+    """
+    header = []
+    for line in lines:
+        if header is not None:
+            if START_MARKER.search(line):
+                header = None
+                continue
+            header.append(line)
+            if len(header) < HEADER_LINES:
+                continue
+            yield from header
+            header = None
+            continue
+        if END_MARKER.search(line):
+            return
+        yield line
+    if header:
+        yield from header
+
+
+def iter_passages(lines, words_per_passage=200, overlap=40):
+    """
+    Groups lines of text into passages of about words_per_passage words, each starting
+    with the last overlap words of the one before so answers spanning a boundary aren't lost.
+    """
+    words = []
+    fresh = 0
+    for line in lines:
+        line_words = line.split()
+        words.extend(line_words)
+        fresh += len(line_words)
+        if len(words) >= words_per_passage:
+            yield " ".join(words)
+            words = words[-overlap:] if overlap else []
+            fresh = 0
+    if fresh:
+        yield " ".join(words)
+
+
+class _SizeLimitedStream(io.RawIOBase):
+    """
+    Reads through to stream, raising ValueError once more than max_bytes have been read.
+    """
+
+    def __init__(self, stream, max_bytes, name):
+        self._stream = stream
+        self._remaining = max_bytes
+        self._max_bytes = max_bytes
+        self._name = name
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self._stream.readinto(buffer)
+        self._remaining -= count
+        if self._remaining < 0:
+            raise ValueError(f"{self._name} is larger than {self._max_bytes} bytes")
+        return count
+
+
+def _limited(stream, max_bytes, name):
+    if max_bytes is None:
+        return stream
+    return io.BufferedReader(_SizeLimitedStream(stream, max_bytes, name))
+
+
+def iter_book_lines(path, max_bytes=None):
+    """
+    Yields the lines of a downloaded book: a zip holding its text or HTML (the text is
+    preferred), or a plain text or HTML file. Raises ValueError once the (decompressed)
+    text passes max_bytes.
+    """
+    name = os.path.basename(path)
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = [info for info in archive.infolist() if not info.is_dir()]
+            texts = [info for info in members if info.filename.lower().endswith(".txt")]
+            pages = [info for info in members if info.filename.lower().endswith((".htm", ".html", ".xhtml"))]
+            candidates = texts or pages
+            if not candidates:
+                raise LookupError(f"No text or HTML file in {os.path.basename(path)}")
+            member = max(candidates, key=lambda info: info.file_size)
+            # The declared size can't be trusted, so the stream is limited as well.
+            if max_bytes is not None and member.file_size > max_bytes:
+                raise ValueError(f"{member.filename} in {name} is larger than {max_bytes} bytes")
+            with archive.open(member) as stream:
+                yield from iter_text_lines(_limited(stream, max_bytes, name), is_html=not texts)
+        return
+    with open(path, "rb") as stream:
+        is_html = path.lower().endswith((".htm", ".html", ".xhtml"))
+        yield from iter_text_lines(_limited(stream, max_bytes, name), is_html=is_html)
+
+
+def _write_array(path, values):
+    with open(path, "wb") as f:
+        values.tofile(f)
+
+
+def build_index(passages, directory):
+    """
+    Writes a BM25 index over an iterable of passages to directory. The index is built
+    in a temporary directory next to it and renamed into place, so readers never see a
+    partial index.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".build-")
+    try:
+        postings = defaultdict(lambda: array.array("I"))
+        lengths = array.array("I")
+        offsets = array.array("Q", [0])
+        with open(os.path.join(tmp, "passages.bin"), "wb") as f:
+            for doc, passage in enumerate(passages):
+                data = passage.encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+                counts = Counter(tokenize(passage))
+                lengths.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    postings[term].extend((doc, tf))
+
+        terms = {}
+        start = 0
+        with open(os.path.join(tmp, "postings.bin"), "wb") as f:
+            for term in sorted(postings):
+                values = postings[term]
+                values.tofile(f)
+                terms[term] = [start, len(values) // 2]
+                start += len(values) // 2
+        _write_array(os.path.join(tmp, "lengths.bin"), lengths)
+        _write_array(os.path.join(tmp, "offsets.bin"), offsets)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "version": INDEX_VERSION,
+                "passages": len(lengths),
+                "avgdl": sum(lengths) / len(lengths) if lengths else 0.0,
+                "terms": terms
+            }, f)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # Another process built the same index first.
+            if not os.path.exists(os.path.join(directory, "meta.json")):
+                raise
+    finally:
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _map(path, typecode):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped.
+            return memoryview(array.array(typecode))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    return view if typecode == "B" else view.cast(typecode)
+
+
+class BookIndex:
+    """
+    A memory-mapped BM25 index over the passages of one book.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.passage_count = meta["passages"]
+        self.avgdl = meta["avgdl"] or 1.0
+        self.terms = meta["terms"]
+        self._postings = _map(os.path.join(directory, "postings.bin"), "I")
+        self._lengths = _map(os.path.join(directory, "lengths.bin"), "I")
+        self._offsets = _map(os.path.join(directory, "offsets.bin"), "Q")
+        self._passages = _map(os.path.join(directory, "passages.bin"), "B")
+
+    def passage(self, doc):
+        return bytes(self._passages[self._offsets[doc]:self._offsets[doc + 1]]).decode("utf-8")
+
+    def search(self, query, k=5, k1=1.2, b=0.75):
+        """
+        Returns up to k (score, passage number, passage text) tuples for the passages
+        that best match query under BM25, best first.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            start, df = entry
+            idf = math.log(1 + (self.passage_count - df + 0.5) / (df + 0.5))
+            postings = self._postings[start * 2:(start + df) * 2]
+            for x in range(0, df * 2, 2):
+                doc, tf = postings[x], postings[x + 1]
+                norm = k1 * (1 - b + b * self._lengths[doc] / self.avgdl)
+                scores[doc] += idf * tf * (k1 + 1) / (tf + norm)
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, doc, self.passage(doc)) for doc, score in top]
+
+
+class BookIndexStore:
+    """
+    Finds, and on first use builds, the index of each book. Book files come from
+    source_dir when one is given (files named <id>.zip, <id>.txt, <id>.html or <id>.htm,
+    e.g. test fixtures or a local mirror), otherwise from the book's book_download URL.
+    Open indexes are kept in an LRU of max_open books. Downloads and the decompressed
+    text are each limited to max_bytes.
+    """
+
+    SOURCE_SUFFIXES = (".zip", ".txt", ".html", ".htm")
+
+    def __init__(self, directory, source_dir=None, session=None, timeout=60,
+                 words_per_passage=200, overlap=40, max_open=64, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.source_dir = source_dir
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.words_per_passage = words_per_passage
+        self.overlap = overlap
+        self.max_bytes = max_bytes
+        self._open = LRUCache(maxsize=max_open)
+        self._flight = SingleFlight()
+
+    def get(self, book):
+        """
+        Returns the BookIndex of a tidy book. Raises LookupError when the book has no text
+        to index, requests or zipfile errors when its download fails, and ValueError when
+        it is larger than max_bytes.
+        """
+        book_id = book.get("id")
+        index = self._open.get(book_id)
+        if index is None:
+            index = self._flight.do(book_id, self._load, book)
+            self._open.set(book_id, index)
+        return index
+
+    def _load(self, book):
+        directory = os.path.join(self.directory, f"{book.get('id')}.v{INDEX_VERSION}")
+        if not os.path.exists(os.path.join(directory, "meta.json")):
+            with self._book_file(book) as path:
+                lines = iter_body_lines(iter_book_lines(path, self.max_bytes))
+                build_index(iter_passages(lines, self.words_per_passage, self.overlap), directory)
+        return BookIndex(directory)
+
+    @contextmanager
+    def _book_file(self, book):
+        book_id = book.get("id")
+        if self.source_dir:
+            for suffix in self.SOURCE_SUFFIXES:
+                path = os.path.join(self.source_dir, f"{book_id}{suffix}")
+                if os.path.exists(path):
+                    yield path
+                    return
+            raise LookupError(f"No file for book {book_id} in {self.source_dir}")
+
+        url = book.get("book_download")
+        if not url:
+            raise LookupError(f"Book {book_id} has no download")
+        suffix = os.path.splitext(urlsplit(url).path)[1] or ".zip"
+        os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix=".download-", suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as f, self.session.get(url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                size = 0
+                for chunk in response.iter_content(chunk_size=65536):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ValueError(f"{url} is larger than {self.max_bytes} bytes")
+                    f.write(chunk)
+            yield path
+        finally:
+            os.remove(path)
+
+
+def context_message(books, hits):
+    """
+    Builds the system message that gives the chat model the selected books and the
+    passages retrieved from them. hits holds (score, book, passage) tuples, best first.
+    """
+    lines = []
+    for book in books:
+        authors = ", ".join(author.get("name", "") for author in book.get("authors") or [])
+        byline = f" by {authors}" if authors else ""
+        lines.append(f"- {book.get('title')}{byline} (Gutenberg ID {book.get('id')})")
+    text = "The user has selected these books:\n" + "\n".join(lines)
+    if hits:
+        passages = "\n\n".join(f"[{book.get('title')}]\n{passage}" for _, book, passage in hits)
+        text += (
+            "\n\nPassages from them that are relevant to the user's latest message, most relevant "
+            "first. Base your answer on them when they cover the question and say so when they don't."
+            f"\n\n{passages}"
+        )
+    return {"role": "system", "content": [{"type": "text", "text": text}]}
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+
+def normalize_query_params(params):
+    """
+    Builds a canonical cache key from a dictionary of Gutendex query parameters.
+    Keys are sorted, values are stripped and lowercased, and comma-separated lists
+    (languages, ids, copyright, ...) are sorted so equivalent queries share one key.
+    """
+    items = []
+    for key in sorted(params or {}):
+        value = params[key]
+        if value is None:
+            value = ""
+        value = str(value).strip().lower()
+        if "," in value:
+            value = ",".join(sorted(part.strip() for part in value.split(",")))
+        items.append((str(key).strip(), value))
+    return urlencode(items)
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with an optional time-to-live for each entry.
+    A ttl of None (or 0) keeps entries until they are evicted for space. With a stale_ttl,
+    expired entries are kept that much longer for get_stale().
+    """
+
+    def __init__(self, maxsize=256, ttl=None, stale_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self.stale_ttl = stale_ttl or 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                if expires_at + self.stale_ttl <= time.monotonic():
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key, default=None):
+        """
+        Returns an entry even if it has expired, as long as it is within stale_ttl of
+        expiring.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at + self.stale_ttl <= time.monotonic():
+                del self._data[key]
+                return default
+            self.stale_hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale_hits": self.stale_hits
+        }
+
+
+class DiskCache:
+    """
+    JSON file cache stored in a directory, so that several gunicorn workers on the same
+    host share one copy of each entry. Files are written atomically and expire based on
+    their modification time, and are kept stale_ttl longer for get_stale(). Once the
+    directory holds more than max_entries files the oldest ones are removed.
+    """
+
+    # Only rescan the directory for pruning every this many writes.
+    PRUNE_INTERVAL = 32
+
+    def __init__(self, directory, ttl=None, max_entries=10000, stale_ttl=None):
+        self.directory = directory
+        self.ttl = ttl or None
+        self.stale_ttl = stale_ttl or 0
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key, default=None):
+        value = self._read(key, self.ttl)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def get_stale(self, key, default=None):
+        value = self._read(key, self.ttl and self.ttl + self.stale_ttl)
+        if value is None:
+            return default
+        self.stale_hits += 1
+        return value
+
+    def _read(self, key, max_age):
+        path = self._path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if max_age and age > max_age:
+                if age > self.ttl + self.stale_ttl:
+                    os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._path(key))
+        except (OSError, TypeError, ValueError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % self.PRUNE_INTERVAL == 0
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        """
+        Removes expired entries and, if the directory is still over max_entries,
+        the least recently written ones.
+        """
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+                if self.ttl and now - mtime > self.ttl + self.stale_ttl:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            entries.append((mtime, path))
+        excess = len(entries) - self.max_entries
+        if excess > 0:
+            entries.sort()
+            for _, path in entries[:excess]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits
+        }
+
+
+class ResponseCache:
+    """
+    Two-tier cache for upstream responses keyed on normalized query parameters:
+    an in-memory LRU in front of an optional on-disk tier shared between workers.
+    Responses stay available to get_stale() for stale_ttl seconds after they expire.
+    """
+
+    def __init__(self, maxsize=512, ttl=3600, directory=None, disk_max_entries=10000, stale_ttl=None):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl, stale_ttl=stale_ttl)
+        self.disk = DiskCache(directory, ttl=ttl, max_entries=disk_max_entries, stale_ttl=stale_ttl) if directory else None
+
+    def get(self, params):
+        key = normalize_query_params(params)
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def get_stale(self, params):
+        """
+        Returns the last response stored for params, even if it has expired (within
+        stale_ttl), or None.
+        """
+        key = normalize_query_params(params)
+        value = self.memory.get_stale(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get_stale(key)
+        return value
+
+    def set(self, params, value):
+        key = normalize_query_params(params)
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None
+        }
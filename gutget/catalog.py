@@ -0,0 +1,501 @@
+"""
+Offline Project Gutenberg catalog that answers Gutendex-style queries from a local SQLite
+database, so book lookups don't need gutendex.com.
+
+Build the database from a catalog dump downloaded from gutenberg.org, either the CSV
+catalog (pg_catalog.csv) or the RDF archive (rdf-files.tar.bz2, or an extracted directory):
+
+    python catalog.py ingest pg_catalog.csv --db catalog.sqlite
+    python catalog.py ingest rdf-files.tar.bz2 --db catalog.sqlite
+
+and query it with the same parameters the Gutendex API takes:
+
+    python catalog.py query "topic=gothic&languages=en" --db catalog.sqlite
+
+The CSV catalog has no download counts or file listings, so books ingested from it get
+download_count 0 and formats built from gutenberg.org's standard URL layout. The RDF
+archive carries both.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import tarfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from urllib.parse import parse_qsl, urlencode
+
+PAGE_SIZE = 32
+
+SCHEMA = """
+CREATE TABLE books (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    copyright INTEGER,
+    download_count INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE TABLE book_authors (
+    book_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    birth_year INTEGER,
+    death_year INTEGER
+);
+CREATE TABLE book_languages (
+    book_id INTEGER NOT NULL,
+    code TEXT NOT NULL
+);
+CREATE TABLE book_formats (
+    book_id INTEGER NOT NULL,
+    mime_type TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE book_text USING fts5(
+    title, people, topics, tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+INDEXES = """
+CREATE INDEX idx_books_downloads ON books (download_count DESC, id);
+CREATE INDEX idx_book_authors_book ON book_authors (book_id);
+CREATE INDEX idx_book_authors_birth ON book_authors (birth_year);
+CREATE INDEX idx_book_authors_death ON book_authors (death_year);
+CREATE INDEX idx_book_languages ON book_languages (code, book_id);
+CREATE INDEX idx_book_formats ON book_formats (mime_type, book_id);
+"""
+
+NS = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dcterms": "http://purl.org/dc/terms/",
+    "dcam": "http://purl.org/dc/dcam/",
+    "pgterms": "http://www.gutenberg.org/2009/pgterms/",
+    "marcrel": "http://id.loc.gov/vocabulary/relators/"
+}
+RDF_ABOUT = f"{{{NS['rdf']}}}about"
+RDF_RESOURCE = f"{{{NS['rdf']}}}resource"
+
+# "Shelley, Mary Wollstonecraft, 1797-1851", "Homer, 751? BCE-651? BCE", "Doe, Jane, 1900-"
+AUTHOR_YEARS = re.compile(
+    r",\s*(?P<birth>\d+)?\??\s*(?P<birth_bce>BCE)?\s*-\s*(?P<death>\d+)?\??\s*(?P<death_bce>BCE)?\s*$"
+)
+AUTHOR_ROLE = re.compile(r"\s*\[(?P<role>[^\]]+)\]\s*$")
+
+
+# ---------------------------------------------------------------------------
+# Ingestion
+# ---------------------------------------------------------------------------
+
+def _year(value, bce=False):
+    if value in (None, ""):
+        return None
+    try:
+        year = int(value)
+    except ValueError:
+        return None
+    return -year if bce else year
+
+
+def _split_list(value):
+    return [part.strip() for part in (value or "").split(";") if part.strip()]
+
+
+def default_formats(book_id):
+    """
+    Builds the formats dictionary for a book from gutenberg.org's standard URL layout,
+    used when the catalog dump doesn't list files.
+    """
+    return {
+        "text/html": f"https://www.gutenberg.org/ebooks/{book_id}.html.images",
+        "application/epub+zip": f"https://www.gutenberg.org/ebooks/{book_id}.epub3.images",
+        "text/plain; charset=us-ascii": f"https://www.gutenberg.org/ebooks/{book_id}.txt.utf-8",
+        "application/rdf+xml": f"https://www.gutenberg.org/ebooks/{book_id}.rdf",
+        "image/jpeg": f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}.cover.medium.jpg",
+        "application/zip": f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}-h.zip"
+    }
+
+
+def parse_csv_person(entry):
+    """
+    Parses one entry of the CSV catalog's Authors column into (role, Person).
+    """
+    role = "author"
+    match = AUTHOR_ROLE.search(entry)
+    if match:
+        role = match.group("role").strip().lower()
+        entry = entry[:match.start()]
+    birth_year = death_year = None
+    match = AUTHOR_YEARS.search(entry)
+    if match:
+        birth_year = _year(match.group("birth"), bool(match.group("birth_bce")))
+        death_year = _year(match.group("death"), bool(match.group("death_bce") or match.group("birth_bce")))
+        entry = entry[:match.start()]
+    return role, {"birth_year": birth_year, "death_year": death_year, "name": entry.strip()}
+
+
+def iter_csv_books(path):
+    """
+    Yields Gutendex-shaped book dictionaries from the CSV catalog (pg_catalog.csv).
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            if row.get("Type", "Text") != "Text":
+                continue
+            try:
+                book_id = int(row["Text#"])
+            except (KeyError, ValueError):
+                continue
+            authors, translators = [], []
+            for entry in _split_list(row.get("Authors")):
+                role, person = parse_csv_person(entry)
+                if "translator" in role:
+                    translators.append(person)
+                elif role in ("author", "creator"):
+                    authors.append(person)
+            yield {
+                "id": book_id,
+                "title": (row.get("Title") or "").replace("\n", " ").strip(),
+                "authors": authors,
+                "summaries": [],
+                "translators": translators,
+                "subjects": sorted(_split_list(row.get("Subjects"))),
+                "bookshelves": sorted(_split_list(row.get("Bookshelves"))),
+                "languages": _split_list(row.get("Language")),
+                "copyright": False,
+                "media_type": "Text",
+                "formats": default_formats(book_id),
+                "download_count": 0
+            }
+
+
+def _rdf_values(element, path):
+    return [value.text.strip() for value in element.findall(path, NS) if value.text and value.text.strip()]
+
+
+def _rdf_person(agent):
+    return {
+        "birth_year": _year(agent.findtext("pgterms:birthdate", namespaces=NS)),
+        "death_year": _year(agent.findtext("pgterms:deathdate", namespaces=NS)),
+        "name": (agent.findtext("pgterms:name", namespaces=NS) or "").strip()
+    }
+
+
+def parse_rdf_book(source):
+    """
+    Parses one per-book RDF file from the Project Gutenberg RDF archive into a
+    Gutendex-shaped book dictionary. Returns None for entries that aren't text ebooks.
+    """
+    root = ET.parse(source).getroot()
+    ebook = root.find("pgterms:ebook", NS)
+    if ebook is None:
+        return None
+    try:
+        book_id = int(ebook.get(RDF_ABOUT, "").rsplit("/", 1)[-1])
+    except ValueError:
+        return None
+    media_type = (ebook.findtext("dcterms:type/rdf:Description/rdf:value", namespaces=NS) or "Text").strip()
+    if media_type != "Text":
+        return None
+
+    subjects = []
+    for subject in ebook.findall("dcterms:subject/rdf:Description", NS):
+        member_of = subject.find("dcam:memberOf", NS)
+        # Gutendex lists LCSH subject headings only.
+        if member_of is not None and member_of.get(RDF_RESOURCE, "").endswith("LCSH"):
+            subjects.extend(_rdf_values(subject, "rdf:value"))
+
+    formats = {}
+    for file in ebook.findall("dcterms:hasFormat/pgterms:file", NS):
+        url = file.get(RDF_ABOUT)
+        for mime in _rdf_values(file, "dcterms:format/rdf:Description/rdf:value"):
+            if url and mime not in formats:
+                formats[mime] = url
+
+    rights = ebook.findtext("dcterms:rights", namespaces=NS) or ""
+    if "public domain" in rights.lower():
+        copyright = False
+    elif "copyright" in rights.lower():
+        copyright = True
+    else:
+        copyright = None
+    downloads = ebook.findtext("pgterms:downloads", namespaces=NS)
+
+    return {
+        "id": book_id,
+        "title": " ".join((ebook.findtext("dcterms:title", namespaces=NS) or "").split()),
+        "authors": [_rdf_person(agent) for agent in ebook.findall("dcterms:creator/pgterms:agent", NS)],
+        "summaries": _rdf_values(ebook, "pgterms:marc520"),
+        "translators": [_rdf_person(agent) for agent in ebook.findall("marcrel:trl/pgterms:agent", NS)],
+        "subjects": sorted(set(subjects)),
+        "bookshelves": sorted(set(_rdf_values(ebook, "pgterms:bookshelf/rdf:Description/rdf:value"))),
+        "languages": _rdf_values(ebook, "dcterms:language/rdf:Description/rdf:value"),
+        "copyright": copyright,
+        "media_type": media_type,
+        "formats": formats,
+        "download_count": int(downloads) if downloads and downloads.strip().isdigit() else 0
+    }
+
+
+def iter_rdf_books(path):
+    """
+    Yields Gutendex-shaped book dictionaries from the RDF archive (a .tar/.tar.bz2 file,
+    a directory of extracted RDF files, or a single .rdf file).
+    """
+    if os.path.isdir(path):
+        for dirpath, _, filenames in os.walk(path):
+            for filename in sorted(filenames):
+                if filename.endswith(".rdf"):
+                    book = parse_rdf_book(os.path.join(dirpath, filename))
+                    if book:
+                        yield book
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path, "r:*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(".rdf"):
+                    book = parse_rdf_book(archive.extractfile(member))
+                    if book:
+                        yield book
+    else:
+        book = parse_rdf_book(path)
+        if book:
+            yield book
+
+
+def iter_catalog_books(path):
+    if path.lower().endswith(".csv"):
+        return iter_csv_books(path)
+    return iter_rdf_books(path)
+
+
+def ingest(path, db_path, batch_size=1000):
+    """
+    Loads a Project Gutenberg catalog dump into a fresh SQLite database at db_path and
+    returns the number of books ingested. The database is built next to db_path and
+    moved into place once complete, so running servers keep reading the old copy.
+    """
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(SCHEMA)
+
+    count = 0
+    batch = []
+
+    def flush():
+        conn.executemany(
+            "INSERT OR REPLACE INTO books (id, title, copyright, download_count, data) VALUES (?, ?, ?, ?, ?)",
+            [(b["id"], b["title"], b["copyright"], b["download_count"], json.dumps(b)) for b in batch]
+        )
+        conn.executemany(
+            "INSERT INTO book_authors (book_id, name, birth_year, death_year) VALUES (?, ?, ?, ?)",
+            [(b["id"], a["name"], a["birth_year"], a["death_year"]) for b in batch for a in b["authors"]]
+        )
+        conn.executemany(
+            "INSERT INTO book_languages (book_id, code) VALUES (?, ?)",
+            [(b["id"], code.lower()) for b in batch for code in b["languages"]]
+        )
+        conn.executemany(
+            "INSERT INTO book_formats (book_id, mime_type) VALUES (?, ?)",
+            [(b["id"], mime) for b in batch for mime in b["formats"]]
+        )
+        conn.executemany(
+            "INSERT INTO book_text (rowid, title, people, topics) VALUES (?, ?, ?, ?)",
+            [
+                (
+                    b["id"],
+                    b["title"],
+                    "; ".join(a["name"] for a in b["authors"]),
+                    "; ".join(b["subjects"] + b["bookshelves"])
+                )
+                for b in batch
+            ]
+        )
+        batch.clear()
+
+    with conn:
+        for book in iter_catalog_books(path):
+            batch.append(book)
+            count += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        conn.executescript(INDEXES)
+    conn.execute("ANALYZE")
+    conn.close()
+    os.replace(tmp_path, db_path)
+    return count
+
+
+# ---------------------------------------------------------------------------
+# Query engine
+# ---------------------------------------------------------------------------
+
+def _int_param(value):
+    """
+    Returns a query parameter as an int, or None when it is missing or not an integer.
+    """
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _fts_phrase(text, prefix=True):
+    phrase = '"' + text.replace('"', '""') + '"'
+    return phrase + "*" if prefix else phrase
+
+
+class Catalog:
+    """
+    Read-only query engine over a database built by ingest(). query() accepts the same
+    parameters as the Gutendex /books endpoint and returns a page in the same shape.
+    """
+
+    def __init__(self, db_path, page_size=PAGE_SIZE):
+        self.db_path = db_path
+        self.page_size = page_size
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def _build_filters(self, params):
+        clauses = []
+        args = []
+
+        ids = params.get("ids")
+        if ids:
+            id_list = [int(i) for i in str(ids).split(",") if i.strip().isdigit()]
+            clauses.append(f"b.id IN ({','.join('?' * len(id_list))})" if id_list else "0")
+            args.extend(id_list)
+
+        languages = params.get("languages")
+        if languages:
+            codes = [c.strip().lower() for c in str(languages).split(",") if c.strip()]
+            clauses.append(
+                f"b.id IN (SELECT book_id FROM book_languages WHERE code IN ({','.join('?' * len(codes))}))"
+            )
+            args.extend(codes)
+
+        # A book matches when at least one author was alive somewhere in the given range.
+        # Years that aren't integers (e.g. "1800s" from the LLM) are ignored, as by Gutendex.
+        year_start = _int_param(params.get("author_year_start"))
+        year_end = _int_param(params.get("author_year_end"))
+        if year_start is not None or year_end is not None:
+            conditions = []
+            if year_start is not None:
+                conditions.append("(a.birth_year >= ? OR a.death_year >= ?)")
+                args.extend([year_start] * 2)
+            if year_end is not None:
+                conditions.append("(a.birth_year <= ? OR a.death_year <= ?)")
+                args.extend([year_end] * 2)
+            clauses.append(
+                "b.id IN (SELECT a.book_id FROM book_authors a WHERE " + " AND ".join(conditions) + ")"
+            )
+
+        copyright = params.get("copyright")
+        if copyright:
+            options = []
+            for value in str(copyright).lower().split(","):
+                value = value.strip()
+                if value == "true":
+                    options.append("b.copyright = 1")
+                elif value == "false":
+                    options.append("b.copyright = 0")
+                elif value == "null":
+                    options.append("b.copyright IS NULL")
+            if options:
+                clauses.append("(" + " OR ".join(options) + ")")
+
+        mime_type = params.get("mime_type")
+        if mime_type:
+            clauses.append("b.id IN (SELECT book_id FROM book_formats WHERE mime_type LIKE ? ESCAPE '\\')")
+            escaped = str(mime_type).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            args.append(escaped + "%")
+
+        match = []
+        search = params.get("search")
+        if search and str(search).split():
+            words = " AND ".join(_fts_phrase(word) for word in str(search).split())
+            match.append(f"{{title people}} : ({words})")
+        topic = params.get("topic")
+        if topic and str(topic).strip():
+            match.append(f"topics : {_fts_phrase(str(topic).strip())}")
+        if match:
+            clauses.append("b.id IN (SELECT rowid FROM book_text WHERE book_text MATCH ?)")
+            args.append(" AND ".join(match))
+
+        return clauses, args
+
+    def query(self, params, page=None):
+        """
+        Returns {"count", "next", "previous", "results"} for a dictionary of Gutendex query
+        parameters. The page defaults to the "page" parameter, as with Gutendex.
+        """
+        params = dict(params or {})
+        page = page or _int_param(params.pop("page", None)) or 1
+        clauses, args = self._build_filters(params)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+
+        sort = str(params.get("sort", "popular")).lower()
+        if sort == "ascending":
+            order = "b.id ASC"
+        elif sort == "descending":
+            order = "b.id DESC"
+        else:
+            order = "b.download_count DESC, b.id ASC"
+
+        conn = self._connection()
+        count = conn.execute(f"SELECT COUNT(*) FROM books b{where}", args).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT b.data FROM books b{where} ORDER BY {order} LIMIT ? OFFSET ?",
+            args + [self.page_size, (page - 1) * self.page_size]
+        ).fetchall()
+
+        def page_link(number):
+            return "?" + urlencode(dict(params, page=number))
+
+        return {
+            "count": count,
+            "next": page_link(page + 1) if page * self.page_size < count else None,
+            "previous": page_link(page - 1) if page > 1 else None,
+            "results": [json.loads(data) for (data,) in rows]
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Project Gutenberg catalog")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Build the catalog database from a dump")
+    ingest_parser.add_argument("path", help="pg_catalog.csv, rdf-files.tar(.bz2), or a directory of RDF files")
+    ingest_parser.add_argument("--db", default="catalog.sqlite")
+
+    query_parser = subparsers.add_parser("query", help="Run a Gutendex-style query against the catalog")
+    query_parser.add_argument("params", help='Query string, e.g. "topic=gothic&languages=en"')
+    query_parser.add_argument("--db", default="catalog.sqlite")
+
+    args = parser.parse_args(argv)
+    if args.command == "ingest":
+        start = time.perf_counter()
+        count = ingest(args.path, args.db)
+        print(f"Ingested {count} books into {args.db} in {time.perf_counter() - start:.1f}s")
+    else:
+        start = time.perf_counter()
+        data = Catalog(args.db).query(dict(parse_qsl(args.params.lstrip("?"))))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(json.dumps(data, indent=2))
+        print(f"{data['count']} books in {elapsed_ms:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Token-budgeted compaction of /chat conversations.
+
+Conversations arrive as lists of {"role", "text"} messages and are resent in full on
+every turn. When one grows past the token budget, its older turns are folded into a
+summary and only the recent turns are sent verbatim. Turns are folded in whole blocks,
+so the summary and the messages after it stay the same from one turn to the next until
+the next block is folded, which keeps the prompt prefix stable for upstream prompt
+caching.
+"""
+import hashlib
+import json
+
+from cache import LRUCache
+
+# Rough per-message overhead of the chat format, in tokens.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You summarize conversations between a user and a librarian assistant that helps them "
+    "find books on Project Gutenberg. Write a concise summary of the conversation so far that "
+    "the assistant can rely on instead of the full transcript. Keep the user's interests, "
+    "preferences and constraints, every book, author and Gutenberg ID mentioned, and any open "
+    "questions. Write plain text without preamble."
+)
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens in text at about four characters per token, which is
+    close enough for budgeting English text without a tokenizer.
+    """
+    return (len(text or "") + 3) // 4
+
+
+def message_tokens(message):
+    return estimate_tokens(message.get("text", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def split_conversation(conversation, budget, keep_recent=6, fold_block=8, summary_tokens=400):
+    """
+    Splits a conversation into (system, folded, recent) message lists.
+    System messages are always kept. When the rest doesn't fit in budget tokens, the
+    oldest turns are folded, a multiple of fold_block at a time, until the recent turns
+    fit alongside the system messages and a summary of up to summary_tokens. At least
+    keep_recent turns are always kept verbatim. A budget of 0 or less disables folding.
+    """
+    system = [message for message in conversation if message.get("role") == "system"]
+    turns = [message for message in conversation if message.get("role") != "system"]
+    sizes = [message_tokens(message) for message in turns]
+    if budget <= 0 or sum(message_tokens(message) for message in system) + sum(sizes) <= budget:
+        return system, [], turns
+
+    available = budget - summary_tokens - sum(message_tokens(message) for message in system)
+    max_folded = max(len(turns) - keep_recent, 0) // fold_block * fold_block
+    folded = 0
+    remaining = sum(sizes)
+    while folded < max_folded and remaining > available:
+        remaining -= sum(sizes[folded:folded + fold_block])
+        folded += fold_block
+    return system, turns[:folded], turns[folded:]
+
+
+def prefix_keys(turns, fold_block):
+    """
+    Returns a cache key for each block-aligned prefix of turns (the first fold_block
+    turns, the first 2 * fold_block, ...). Each key chains the previous one, so all of
+    them are computed in one pass.
+    """
+    keys = []
+    digest = ""
+    for start in range(0, len(turns) - len(turns) % fold_block, fold_block):
+        block = [[message.get("role", "user"), message.get("text", "")] for message in turns[start:start + fold_block]]
+        digest = hashlib.sha256((digest + json.dumps(block)).encode("utf-8")).hexdigest()
+        keys.append(digest)
+    return keys
+
+
+def build_summary_messages(previous_summary, turns):
+    """
+    Builds the chat messages that ask the model to summarize turns, extending
+    previous_summary (the summary of the turns before them) when there is one.
+    """
+    transcript = "\n\n".join(f"{message.get('role', 'user')}: {message.get('text', '')}" for message in turns)
+    if previous_summary:
+        text = (
+            f"Summary of the conversation so far:\n{previous_summary}\n\n"
+            f"It continues:\n{transcript}\n\nWrite the updated summary."
+        )
+    else:
+        text = f"Conversation:\n{transcript}\n\nWrite the summary."
+    return [
+        {"role": "system", "content": [{"type": "text", "text": SUMMARY_SYSTEM_PROMPT}]},
+        {"role": "user", "content": [{"type": "text", "text": text}]}
+    ]
+
+
+def summary_message(summary):
+    """
+    Formats a summary of folded turns as a system message for the chat model.
+    """
+    return {
+        "role": "system",
+        "content": [
+            {"type": "text", "text": f"Summary of the earlier conversation:\n{summary}"}
+        ]
+    }
+
+
+class SummaryCache:
+    """
+    Caches the summaries of folded conversation prefixes, keyed by prefix_keys(), so a
+    summary is only generated once per block and can be extended with the next block
+    instead of re-summarizing the whole history.
+    """
+
+    def __init__(self, fold_block=8, maxsize=1024, ttl=86400):
+        self.fold_block = fold_block
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, folded):
+        keys = prefix_keys(folded, self.fold_block)
+        return self._cache.get(keys[-1]) if keys else None
+
+    def set(self, folded, summary):
+        keys = prefix_keys(folded, self.fold_block)
+        if keys:
+            self._cache.set(keys[-1], summary)
+
+    def latest(self, folded):
+        """
+        Returns (summary, turns) for the longest cached prefix of folded: its summary (or
+        None when nothing is cached) and the folded turns that come after it.
+        """
+        keys = prefix_keys(folded, self.fold_block)
+        for blocks in range(len(keys) - 1, 0, -1):
+            summary = self._cache.get(keys[blocks - 1])
+            if summary is not None:
+                return summary, folded[blocks * self.fold_block:]
+        return None, folded
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,239 @@
+"""
+Cover image proxy for graph nodes.
+
+Each cover is downloaded from Gutenberg once and resized to thumbnails of a few fixed
+widths. Originals and thumbnails are kept in an on-disk cache that several gunicorn
+workers can share. The cache is bounded in bytes and drops the least recently used
+images first. Resizing needs Pillow; without it the original image is served at every
+width.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+import requests
+
+from singleflight import SingleFlight
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - Pillow is optional
+    Image = None
+
+# Leading bytes of the image formats Gutenberg serves covers in.
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp")
+]
+
+
+def sniff_image_type(data):
+    """
+    Returns the MIME type of image data from its leading bytes, or None if it isn't an image.
+    """
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    return None
+
+
+def make_thumbnail(data, width, quality=80):
+    """
+    Returns a JPEG of the image scaled down to width pixels wide, or None when Pillow isn't
+    installed, can't decode the image, or the image is already at most that wide. In each
+    case the original can be served instead.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width <= width:
+                return None
+            image.thumbnail((width, image.height))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+    except (OSError, Image.DecompressionBombError):
+        # UnidentifiedImageError and truncated files are OSErrors.
+        return None
+    return output.getvalue()
+
+
+def cover_etag(data):
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Returns True when an If-None-Match header matches etag (weak comparison).
+    """
+    for tag in (if_none_match or "").split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag:
+            return True
+    return False
+
+
+class ImageDiskCache:
+    """
+    Directory of image files bounded to max_bytes in total. Reading an entry touches its
+    modification time, and once the directory grows past max_bytes the least recently
+    used files are removed until it is back under PRUNE_TARGET of the limit.
+    """
+
+    PRUNE_TARGET = 0.9
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.img")
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".img"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def set(self, key, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._size += len(data)
+            should_prune = self._size > self.max_bytes
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        """
+        Removes the least recently used files until the directory holds at most
+        PRUNE_TARGET * max_bytes. Other workers write to the same directory, so the size
+        is recounted from the files on every prune.
+        """
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        target = self.max_bytes * self.PRUNE_TARGET
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            self.evictions += 1
+        with self._lock:
+            self._size = size
+
+    def stats(self):
+        return {
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+class CoverStore:
+    """
+    Serves cover images by URL at their original size (width 0) or as thumbnails of the
+    given width, downloading each original at most once while it stays cached.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, session=None, timeout=10,
+                 max_download_bytes=5 * 1024 * 1024):
+        self.cache = ImageDiskCache(directory, max_bytes=max_bytes)
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.max_download_bytes = max_download_bytes
+        self.downloads = 0
+        self._flight = SingleFlight()
+
+    def get(self, url, width=0):
+        """
+        Returns (data, content_type) for the cover at url. Raises requests errors when the
+        download fails and ValueError when it isn't an image or is too large.
+        """
+        key = f"{width}:{url}"
+        data = self.cache.get(key)
+        if data is None:
+            data = self._flight.do(key, self._load, url, width)
+        return data, sniff_image_type(data)
+
+    def _load(self, url, width):
+        if width:
+            original, _ = self.get(url)
+            thumbnail = make_thumbnail(original, width)
+            if thumbnail is None:
+                # Nothing to resize (or it can't be decoded): serve the original without
+                # storing a second copy.
+                return original
+            self.cache.set(f"{width}:{url}", thumbnail)
+            return thumbnail
+
+        data = self._download(url)
+        if sniff_image_type(data) is None:
+            raise ValueError(f"{url} is not an image")
+        self.cache.set(f"0:{url}", data)
+        return data
+
+    def _download(self, url):
+        chunks = []
+        size = 0
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=65536):
+                size += len(chunk)
+                if size > self.max_download_bytes:
+                    raise ValueError(f"{url} is larger than {self.max_download_bytes} bytes")
+                chunks.append(chunk)
+        self.downloads += 1
+        return b"".join(chunks)
+
+    def stats(self):
+        return dict(self.cache.stats(), downloads=self.downloads, thumbnails=Image is not None)
@@ -0,0 +1,195 @@
+"""
+Per-request stage timing and Prometheus-format metrics.
+
+Code wraps each stage of a request in stage_timer("name"). The duration goes into the
+gutget_stage_duration_seconds histogram and into the RequestTimings of the request being
+served (tracked in a context variable, so it works for Flask threads and asyncio tasks
+alike). render() produces the text served at /metrics.
+
+Metrics live in process memory, so with several gunicorn workers each worker reports its
+own numbers.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("gutget.metrics")
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labelvalues, list(state)) for labelvalues, state in self._values.items())
+        for labelvalues, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, labelvalues, [("le", le)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {state[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        Registers a function called on every render that returns extra samples as
+        (name, type, documentation, [(labels dict, value), ...]) tuples, for values
+        that are tracked elsewhere such as cache statistics.
+        """
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        self._collectors.remove(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "gutget_stage_duration_seconds", "Time spent in each stage of handling a request.", ["stage"]
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "gutget_request_duration_seconds", "End-to-end request latency.", ["endpoint", "status"]
+)
+
+_current_request = contextvars.ContextVar("gutget_current_request", default=None)
+
+
+class RequestTimings:
+    """
+    Accumulates the time one request spends in each stage.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.total = None
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        # Prefetch threads and tasks can report stages concurrently.
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self, status):
+        self.total = time.perf_counter() - self.started_at
+        REQUEST_SECONDS.observe(self.total, self.endpoint, str(status))
+        return self.total
+
+    def server_timing(self):
+        """
+        Formats the stages as a Server-Timing header value, shown by browser dev tools.
+        """
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        if self.total is not None:
+            entries.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(entries)
+
+    def as_dict(self):
+        return {
+            "endpoint": self.endpoint,
+            "total_ms": round((self.total or 0) * 1000, 1),
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+        }
+
+
+def start_request(endpoint):
+    timings = RequestTimings(endpoint)
+    _current_request.set(timings)
+    return timings
+
+
+def current_request():
+    return _current_request.get()
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Times the enclosed block as one stage of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        timings = _current_request.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+class SlowRequestLog:
+    """
+    Logs the stage breakdown of requests slower than threshold seconds, for a random
+    sample_rate fraction of them so a slow upstream doesn't flood the logs.
+    """
+
+    def __init__(self, threshold=2.0, sample_rate=0.1):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+
+    def maybe_log(self, timings, status):
+        if timings.total is None or timings.total < self.threshold:
+            return
+        if random.random() >= self.sample_rate:
+            return
+        logger.warning("Slow request: %s", json.dumps(dict(timings.as_dict(), status=status)))
@@ -0,0 +1,212 @@
+"""
+Deterministic fast path for translating simple requests into Gutendex query parameters.
+
+Requests such as "books by Jane Austen", "french poetry", "19th century gothic" or
+"book 1342" map directly onto Gutendex parameters. parse_simple_query() handles them
+with a small lexicon and a few rules and returns the same query_params shape as the LLM
+translation together with a confidence score. Anything it doesn't fully understand gets
+a low score, so the caller can fall back to the LLM.
+"""
+import re
+import threading
+
+from query_translation import normalize_user_text
+
+LANGUAGES = {
+    "english": "en", "french": "fr", "german": "de", "spanish": "es", "italian": "it",
+    "portuguese": "pt", "dutch": "nl", "finnish": "fi", "swedish": "sv", "danish": "da",
+    "norwegian": "no", "latin": "la", "greek": "el", "russian": "ru", "chinese": "zh",
+    "japanese": "ja", "polish": "pl", "hungarian": "hu", "czech": "cs", "catalan": "ca",
+    "esperanto": "eo", "tagalog": "tl", "welsh": "cy", "icelandic": "is", "hebrew": "he"
+}
+
+# Phrase -> Gutendex topic (matched against bookshelves and subjects).
+TOPICS = {
+    "science fiction": "science fiction", "sci fi": "science fiction", "scifi": "science fiction",
+    "gothic": "gothic", "horror": "horror", "ghost stories": "ghost stories", "ghosts": "ghost",
+    "vampires": "vampires", "detective": "detective", "mystery": "mystery", "mysteries": "mystery",
+    "crime": "crime", "poetry": "poetry", "poems": "poetry", "drama": "drama", "plays": "drama",
+    "romance": "romance", "love stories": "love stories", "adventure": "adventure",
+    "adventures": "adventure", "fantasy": "fantasy", "fairy tales": "fairy tales",
+    "mythology": "mythology", "myths": "mythology", "folklore": "folklore",
+    "children": "children", "childrens": "children", "children s": "children", "kids": "children",
+    "history": "history", "historical fiction": "historical fiction", "philosophy": "philosophy",
+    "religion": "religion", "humor": "humor", "humour": "humor", "satire": "satire",
+    "travel": "travel", "biography": "biography", "biographies": "biography",
+    "autobiography": "autobiography", "war": "war", "westerns": "western", "western": "western",
+    "sea stories": "sea stories", "pirates": "pirates", "short stories": "short stories",
+    "essays": "essays", "science": "science", "mathematics": "mathematics", "economics": "economics",
+    "politics": "politics", "cooking": "cooking", "christmas": "christmas", "music": "music",
+    "psychology": "psychology", "animals": "animals", "nature": "nature"
+}
+
+# Author-lifetime ranges for named eras.
+ERAS = {"victorian": (1837, 1901), "elizabethan": (1558, 1603), "georgian": (1714, 1837)}
+
+# Words that carry no meaning for the query.
+FILLER = set(
+    "a an the any some all good great best popular famous classic classics free "
+    "book books ebook ebooks novel novels story stories text texts work works literature fiction "
+    "title titles writing writings project gutenberg "
+    "give show find list get recommend suggest search look looking want would like love read "
+    "i me my you can could please for to of about on in from with that are is era period "
+    "something anything written language".split()
+)
+
+# Words that introduce Gutenberg IDs ("book 1342", "ids 11 12 and 13").
+ID_MARKERS = {"book", "books", "ebook", "ebooks", "id", "ids", "number", "no"}
+
+ORDINAL_CENTURY = re.compile(r"^(\d{1,2})(?:st|nd|rd|th)$")
+DECADE = re.compile(r"^(\d{3})0s$")
+YEAR = re.compile(r"^\d{3,4}$")
+
+
+def _match_phrase(tokens, start, lexicon, max_words=3):
+    """
+    Returns (value, length) for the longest phrase in lexicon starting at tokens[start].
+    """
+    for length in range(min(max_words, len(tokens) - start), 0, -1):
+        value = lexicon.get(" ".join(tokens[start:start + length]))
+        if value is not None:
+            return value, length
+    return None, 0
+
+
+def _is_keyword(tokens, start):
+    token = tokens[start]
+    return (
+        token in FILLER or token in LANGUAGES or token in ERAS or token in ("by", "and", "before", "after")
+        or _match_phrase(tokens, start, TOPICS)[0] is not None
+        or ORDINAL_CENTURY.match(token) or DECADE.match(token) or token.isdigit()
+    )
+
+
+def parse_simple_query(user_query):
+    """
+    Translates a simple request into Gutendex query parameters using rules and a lexicon.
+    Returns (query_params, confidence), where confidence is between 0 and 1 and
+    query_params is None when nothing in the request was recognized. Like the LLM
+    translation, English is requested unless another language is named.
+    """
+    tokens = normalize_user_text(user_query).split()
+    params = {}
+    topics = []
+    languages = []
+    authors = []
+    unknown = []
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ID_MARKERS and i + 1 < len(tokens) and tokens[i + 1].isdigit():
+            ids = []
+            i += 1
+            while i < len(tokens) and (tokens[i].isdigit() or (tokens[i] == "and" and i + 1 < len(tokens) and tokens[i + 1].isdigit())):
+                if tokens[i].isdigit():
+                    ids.append(tokens[i])
+                i += 1
+            params["ids"] = ",".join(ids)
+            continue
+        if token == "by":
+            i += 1
+            while i < len(tokens) and not _is_keyword(tokens, i) and tokens[i].isalpha():
+                authors.append(tokens[i])
+                i += 1
+            if not authors:
+                unknown.append(token)
+            continue
+        century = ORDINAL_CENTURY.match(token)
+        if century and i + 1 < len(tokens) and tokens[i + 1] in ("century", "centuries"):
+            start = (int(century.group(1)) - 1) * 100
+            params["author_year_start"], params["author_year_end"] = str(start), str(start + 99)
+            i += 2
+            continue
+        decade = DECADE.match(token)
+        if decade:
+            start = int(decade.group(1)) * 10
+            span = 99 if start % 100 == 0 else 9
+            params["author_year_start"], params["author_year_end"] = str(start), str(start + span)
+            i += 1
+            continue
+        if token in ("before", "after") and i + 1 < len(tokens) and YEAR.match(tokens[i + 1]):
+            year = int(tokens[i + 1])
+            if token == "before":
+                params["author_year_end"] = str(year - 1)
+            else:
+                params["author_year_start"] = str(year)
+            i += 2
+            continue
+        if token in ERAS:
+            params["author_year_start"], params["author_year_end"] = (str(year) for year in ERAS[token])
+            i += 1
+            continue
+        if token in LANGUAGES:
+            languages.append(LANGUAGES[token])
+            i += 1
+            continue
+        topic, length = _match_phrase(tokens, i, TOPICS)
+        if topic is not None:
+            if topic not in topics:
+                topics.append(topic)
+            i += length
+            continue
+        if token not in FILLER and token != "and":
+            unknown.append(token)
+        i += 1
+
+    if topics:
+        params["topic"] = topics[0]
+    if authors:
+        params["search"] = " ".join(authors)
+    if not params and not languages:
+        return None, 0.0
+    if "ids" not in params:
+        params["languages"] = ",".join(languages) if languages else "en"
+
+    if unknown:
+        confidence = 0.3
+    elif len(topics) > 1 or len(authors) > 4:
+        # Gutendex takes a single topic, and long "by ..." phrases are rarely just a name.
+        confidence = 0.5
+    elif "ids" in params:
+        # IDs pick exact books; next to other filters the number is more likely part of
+        # the request ("gothic books #7", "no 5 romance"), so leave those to the LLM.
+        confidence = 0.95 if len(params) == 1 and not languages else 0.5
+    else:
+        confidence = 0.9
+    return params, confidence
+
+
+class FastPathTranslator:
+    """
+    Answers requests that parse_simple_query() understands with at least threshold
+    confidence and counts how often it can skip the LLM.
+    """
+
+    def __init__(self, threshold=0.8):
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def translate(self, user_query):
+        """
+        Returns the query parameters for user_query, or None when the LLM is needed.
+        """
+        query_params, confidence = parse_simple_query(user_query)
+        hit = query_params is not None and confidence >= self.threshold
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return query_params if hit else None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None
+        }
@@ -0,0 +1,144 @@
+import re
+import unicodedata
+from urllib.parse import parse_qsl
+
+from cache import LRUCache
+
+# System prompt used to translate a natural-language request into a Gutendex query string.
+QUERY_SYSTEM_PROMPT = (
+    "You are a helpful librarian assistant that is designed to assist users with finding, "
+    "discovering and exploring books on Project Gutenberg by making API requests to the gutindex API. "
+    "Below is the documentation required to use this API. Make your best judgement as to the query required "
+    "in order to return the most appropriate books. Only provide the API request and nothing else. Unless asked otherwise, provide books only in english. \n\n"
+    "Lists of Books\n"
+    "Lists of book information in the database are queried using the API at /books (e.g. gutendex.com/books). "
+    "Book data will be returned in the format\n\n"
+    "{\n  \"count\": <number>,\n  \"next\": <string or null>,\n  \"previous\": <string or null>,\n  "
+    "\"results\": <array of Books>\n}\n"
+    "where results is an array of 0-32 book objects, next and previous are URLs to the next and previous pages of results, "
+    "and count in the total number of books for the query on all pages combined.\n\n"
+    "By default, books are ordered by popularity, determined by their numbers of downloads from Project Gutenberg.\n\n"
+    "Parameters can also be added to book-list queries in a typical URL format. For example, to get the first page of written by authors alive after 1899 "
+    "and published in English or French, you can go to /books?author_year_start=1900&languages=en,fr\n\n"
+    "You can find available query parameters below.\n\n"
+    "author_year_start and author_year_end\n"
+    "Use these to find books with at least one author alive in a given range of years. They must have positive or negative integer values. "
+    "For example, /books?author_year_end=-499 gives books with authors alive before 500 BCE, and /books?author_year_start=1800&author_year_end=1899 gives books with authors alive in the 19th Century.\n\n"
+    "copyright\n"
+    "Use this to find books with a certain copyright status: true for books with existing copyrights, false for books in the public domain in the USA, "
+    "or null for books with no available copyright information. These can be combined with commas. For example, /books?copyright=true,false gives books with available copyright information.\n\n"
+    "ids\n"
+    "Use this to list books with Project Gutenberg ID numbers in a given list of numbers. They must be comma-separated positive integers. "
+    "For example, /books?ids=11,12,13 gives books with ID numbers 11, 12, and 13.\n\n"
+    "languages\n"
+    "Use this to find books in any of a list of languages. They must be comma-separated, two-character language codes. "
+    "For example, /books?languages=en gives books in English, and /books?languages=fr,fi gives books in either French or Finnish or both.\n\n"
+    "mime_type\n"
+    "Use this to find books with a given MIME type. Gutendex gives every book with a MIME type starting with the value. "
+    "For example, /books?mime_type=text%2F gives books with types text/html, text/plain; charset=us-ascii, etc.; and /books?mime_type=text%2Fhtml gives books with types text/html, text/html; charset=utf-8, etc.\n\n"
+    "search\n"
+    "Use this to search author names and book titles with given words. They must be separated by a space (i.e. %20 in URL-encoded format) and are case-insensitive. "
+    "For example, /books?search=dickens%20great includes Great Expectations by Charles Dickens.\n\n"
+    "sort\n"
+    "Use this to sort books: ascending for Project Gutenberg ID numbers from lowest to highest, descending for IDs highest to lowest, or popular (the default) for most popular to least popular by number of downloads.\n\n"
+    "topic\n"
+    "Use this to search for a case-insensitive key-phrase in books' bookshelves or subjects. For example, /books?topic=children gives books on the \"Children's Literature\" bookshelf, with the subject \"Sick children -- Fiction\", and so on.\n\n"
+    "Individual Books\n"
+    "Individual books can be found at /books/<id>, where <id> is the book's Project Gutenberg ID number. Error responses will appear in this format:\n\n"
+    "{\n  \"detail\": <string of error message>\n}\n"
+    "API Objects\n"
+    "Types of JSON objects served by Gutendex are given below.\n\n"
+    "Book\n"
+    "{\n  \"id\": <number of Project Gutenberg ID>,\n  \"title\": <string>,\n  \"subjects\": <array of strings>,\n  "
+    "\"authors\": <array of Persons>,\n  \"summaries\": <array of strings>,\n  \"translators\": <array of Persons>,\n  "
+    "\"bookshelves\": <array of strings>,\n  \"languages\": <array of strings>,\n  \"copyright\": <boolean or null>,\n  "
+    "\"media_type\": <string>,\n  \"formats\": <Format>,\n  \"download_count\": <number>\n}\n\n"
+    "Format\n"
+    "{\n  <string of MIME-type>: <string of URL>,\n  ...\n}\n\n"
+    "Person\n"
+    "{\n  \"birth_year\": <number or null>,\n  \"death_year\": <number or null>,\n  \"name\": <string>\n}\n"
+)
+
+
+def build_translation_messages(user_query):
+    """
+    Builds the chat messages that ask the model to translate user_query into a Gutendex query.
+    """
+    return [
+        {
+            "role": "system",
+            "content": [
+                {
+                    "type": "text",
+                    "text": QUERY_SYSTEM_PROMPT
+                }
+            ]
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": user_query
+                }
+            ]
+        }
+    ]
+
+
+def parse_query_string(parsed_query):
+    """
+    Converts the query string returned by the model (e.g. "/books?search=dickens") into
+    a dictionary of Gutendex query parameters.
+    """
+    parsed_query = parsed_query.strip()
+    # Remove a leading '/books' if present.
+    if parsed_query.startswith('/books'):
+        parsed_query = parsed_query[len('/books'):]
+    # Remove any leading '?'.
+    if parsed_query.startswith('?'):
+        parsed_query = parsed_query[1:]
+    return dict(parse_qsl(parsed_query))
+
+
+def normalize_user_text(text):
+    """
+    Normalizes a user query for cache lookups: case-folded, punctuation stripped and
+    whitespace collapsed, so "Gothic novels!" and "  gothic NOVELS" share one entry.
+    """
+    text = "".join(
+        " " if unicodedata.category(ch).startswith("P") else ch
+        for ch in (text or "").casefold()
+    )
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class TranslationCache:
+    """
+    Memoizes the translation from user text to Gutendex query parameters. Entries hold the
+    post-processed query_params dict rather than the raw model output and are evicted by
+    LRU order and TTL.
+    """
+
+    def __init__(self, maxsize=2048, ttl=86400):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, user_query):
+        query_params = self._cache.get(normalize_user_text(user_query))
+        return dict(query_params) if query_params is not None else None
+
+    def set(self, user_query, query_params):
+        self._cache.set(normalize_user_text(user_query), dict(query_params))
+
+    def seed(self, translations):
+        """
+        Pre-seeds the cache from a mapping of user text to either a query string
+        ("/books?topic=gothic") or a dictionary of query parameters.
+        """
+        for user_query, query in translations.items():
+            if isinstance(query, str):
+                query = parse_query_string(query)
+            self.set(user_query, query)
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,120 @@
+"""
+Content negotiation for book and graph payloads.
+
+encode_payload() serializes a payload as JSON (with orjson when it is installed) or as
+MessagePack when the client's Accept header asks for it, and compresses it with brotli
+(when installed) or gzip according to Accept-Encoding. slim_payload() drops the bulky
+fields that the graph view doesn't need up front.
+"""
+import gzip
+import json
+
+import msgpack
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+# Payloads smaller than this aren't worth compressing.
+MIN_COMPRESS_BYTES = 1024
+
+# Book fields left out of slim payloads (fetch them later with /book_summaries).
+SLIM_OMITTED_FIELDS = ("summary",)
+
+
+def parse_quality_list(header):
+    """
+    Parses an Accept or Accept-Encoding header into a {value: quality} dict.
+    """
+    qualities = {}
+    for part in (header or "").split(","):
+        value, *params = [piece.strip() for piece in part.split(";")]
+        if not value:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        qualities[value.lower()] = quality
+    return qualities
+
+
+def choose_format(accept):
+    """
+    Returns "msgpack" when the client prefers MessagePack to JSON, otherwise "json".
+    """
+    qualities = parse_quality_list(accept)
+    msgpack_quality = max((qualities.get(media_type, 0.0) for media_type in MSGPACK_TYPES), default=0.0)
+    json_quality = max(qualities.get(JSON_TYPE, 0.0), qualities.get("application/*", 0.0), qualities.get("*/*", 0.0))
+    return "msgpack" if msgpack_quality > 0 and msgpack_quality >= json_quality else "json"
+
+
+def choose_encoding(accept_encoding):
+    """
+    Returns the best compression the client accepts: "br", "gzip" or None.
+    """
+    qualities = parse_quality_list(accept_encoding)
+    candidates = [name for name in ("br", "gzip") if qualities.get(name, qualities.get("*", 0.0)) > 0]
+    if brotli is None and "br" in candidates:
+        candidates.remove("br")
+    if not candidates:
+        return None
+    return max(candidates, key=lambda name: qualities.get(name, qualities.get("*", 0.0)))
+
+
+def dumps_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_payload(payload, accept=None, accept_encoding=None, min_compress_bytes=MIN_COMPRESS_BYTES):
+    """
+    Serializes and compresses payload for a client. Returns (body, headers).
+    """
+    if choose_format(accept) == "msgpack":
+        body = msgpack.packb(payload, use_bin_type=True)
+        headers = {"Content-Type": "application/msgpack"}
+    else:
+        body = dumps_json(payload)
+        headers = {"Content-Type": JSON_TYPE}
+    headers["Vary"] = "Accept, Accept-Encoding"
+
+    encoding = choose_encoding(accept_encoding) if len(body) >= min_compress_bytes else None
+    if encoding == "br":
+        body = brotli.compress(body, quality=4)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=5, mtime=0)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return body, headers
+
+
+def _slim_book(book):
+    return {key: value for key, value in book.items() if key not in SLIM_OMITTED_FIELDS}
+
+
+def slim_payload(payload):
+    """
+    Returns a copy of a /query_books or graph payload without SLIM_OMITTED_FIELDS in its
+    books ("results") or node data ("nodes").
+    """
+    slim = dict(payload)
+    if "results" in slim:
+        slim["results"] = [_slim_book(book) for book in slim["results"]]
+    if "nodes" in slim:
+        slim["nodes"] = [dict(node, data=_slim_book(node.get("data") or {})) for node in slim["nodes"]]
+    return slim
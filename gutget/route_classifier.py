@@ -0,0 +1,127 @@
+"""
+Local classifier that decides whether a chat message asks for books to be found and
+added to the graph ("query_books_graph") or is a conversational message for the chat
+model ("chat").
+
+Messages are turned into sparse features (words, word pairs and a few keyword patterns)
+and scored by a logistic regression trained at startup from a labelled JSON-lines file
+of {"text": ..., "route": ...} examples. A prediction is a handful of dictionary lookups.
+"""
+import json
+import math
+import random
+import re
+
+from query_parser import parse_simple_query
+from query_translation import normalize_user_text
+
+ROUTES = ("chat", "query_books_graph")
+
+PATTERNS = [
+    ("find", re.compile(r"\b(find|search|look up|look for|fetch|get|show|list|give|need|want)\b")),
+    ("add", re.compile(r"\b(add|put|include|insert|more)\b")),
+    ("recommend", re.compile(r"\b(recommend|suggest|similar|like)\b")),
+    ("book_words", re.compile(r"\b(books?|novels?|stories|poetry|poems|plays|works|literature|titles|reads?)\b")),
+    ("question", re.compile(r"^(who|what|why|how|when|where|which|is|are|does|did|do|was|were)\b")),
+    ("deictic", re.compile(r"\b(this|these|that|those|the|my) (books?|novels?|story|passage|chapter|author|ending)\b")),
+    ("greeting", re.compile(r"^(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening)|bye)\b")),
+    ("by_author", re.compile(r"\bby [a-z]+")),
+    ("content", re.compile(r"\b(summar\w*|explain\w*|themes?|characters?|plot|ending|chapters?|meaning|symboli\w*|quotes?|passages?)\b"))
+]
+
+
+def route_features(text):
+    """
+    Returns the set of sparse features of a message.
+    """
+    normalized = normalize_user_text(text)
+    words = normalized.split()
+    features = {"bias"}
+    features.update(f"w:{word}" for word in words)
+    features.update(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+    if words:
+        features.add(f"first:{words[0]}")
+    features.update(f"p:{name}" for name, pattern in PATTERNS if pattern.search(normalized))
+    # Requests the fast-path query parser fully understands are almost always book searches.
+    _, confidence = parse_simple_query(text)
+    if confidence >= 0.8:
+        features.add("p:fast_path")
+    return features
+
+
+class RouteClassifier:
+    """
+    Binary logistic regression over route_features(). The positive class is
+    "query_books_graph".
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    @classmethod
+    def train(cls, examples, epochs=40, learning_rate=0.3, l2=1e-4, seed=0):
+        """
+        Trains on a list of (text, route) pairs with stochastic gradient descent.
+        """
+        data = [(route_features(text), 1.0 if route == "query_books_graph" else 0.0) for text, route in examples]
+        weights = {}
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for features, label in data:
+                error = label - _sigmoid(sum(weights.get(feature, 0.0) for feature in features))
+                for feature in features:
+                    weight = weights.get(feature, 0.0)
+                    weights[feature] = weight + learning_rate * (error - l2 * weight)
+        return cls(weights)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """
+        Trains on a JSON-lines file of {"text": ..., "route": ...} examples.
+        """
+        examples = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    example = json.loads(line)
+                    if example["route"] not in ROUTES:
+                        raise ValueError(f"Unknown route {example['route']!r} in {path}")
+                    examples.append((example["text"], example["route"]))
+        return cls.train(examples, **kwargs)
+
+    def predict(self, text):
+        """
+        Returns (route, confidence), where confidence is the probability of that route.
+        """
+        weights = self.weights
+        p = _sigmoid(sum(weights.get(feature, 0.0) for feature in route_features(text)))
+        return ("query_books_graph", p) if p >= 0.5 else ("chat", 1 - p)
+
+
+def _sigmoid(x):
+    if x < -30:
+        return 0.0
+    return 1 / (1 + math.exp(-x))
+
+
+ROUTE_SYSTEM_PROMPT = (
+    "You route messages sent to a librarian assistant that builds a graph of Project Gutenberg "
+    "books. Reply with exactly query_books_graph if the user asks to find, recommend or add books, "
+    "or exactly chat for anything else, such as questions about books, authors or passages, and "
+    "small talk."
+)
+
+
+def build_route_messages(text):
+    return [
+        {"role": "system", "content": [{"type": "text", "text": ROUTE_SYSTEM_PROMPT}]},
+        {"role": "user", "content": [{"type": "text", "text": text}]}
+    ]
+
+
+def parse_route(reply):
+    """
+    Reads the route out of the model's reply, defaulting to "chat".
+    """
+    return "query_books_graph" if "query_books_graph" in (reply or "") else "chat"
@@ -0,0 +1,182 @@
+"""
+Content-similarity edges for the book graph.
+
+Each book is described by the words of its subjects, bookshelves and summary. The term
+counts of a book are computed once and cached by Gutenberg ID. When the vocabulary the
+cached counts refer to outgrows max_terms, it is dropped along with the cache and a new
+generation starts, so memory stays bounded however many books are seen. For a graph they are
+stacked into a sparse matrix, weighted with TF-IDF over the books in that graph and
+normalized, so the cosine similarity of every pair is a row of X @ X.T. The product is
+computed a batch of rows at a time and only each book's top-k neighbours are kept, so
+memory stays bounded for graphs of thousands of books.
+"""
+import threading
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+
+from book_index import tokenize
+from cache import LRUCache
+
+
+class Vocabulary:
+    """
+    Thread-safe mapping from term to column index, shared by the book vectors cached in
+one generation.
+    """
+
+    def __init__(self):
+        self.terms = []
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def ids(self, terms):
+        index = self._index
+        missing = [term for term in terms if term not in index]
+        if missing:
+            with self._lock:
+                for term in missing:
+                    if term not in index:
+                        index[term] = len(self.terms)
+                        self.terms.append(term)
+        return [index[term] for term in terms]
+
+    def __len__(self):
+        return len(self.terms)
+
+
+def book_text(book):
+    return " ".join(
+        list(book.get("subjects") or []) + list(book.get("bookshelves") or []) + [book.get("summary") or ""]
+    )
+
+
+class BookVectors:
+    """
+    Computes and caches the term counts of tidy books as (term ids, counts) arrays.
+    """
+
+    MIN_BOOKS_FOR_MAX_DF = 500
+
+    def __init__(self, maxsize=50000, max_terms=500000):
+        self.max_terms = max_terms
+        self.generations = 1
+        self.vocabulary = Vocabulary()
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def counts(self, book, vocabulary=None):
+        """
+        Returns the (term ids, counts) of book, with ids into vocabulary (by default the
+        current one).
+        """
+        if vocabulary is None:
+            vocabulary = self.vocabulary
+        book_id = book.get("id")
+        cached = self._cache.get(book_id) if book_id is not None else None
+        if cached is not None and cached[0] is vocabulary:
+            return cached[1]
+        counts = Counter(tokenize(book_text(book)))
+        entry = (
+            np.array(vocabulary.ids(list(counts)), dtype=np.int32),
+            np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        )
+        if book_id is not None and vocabulary is self.vocabulary:
+            self._cache.set(book_id, (vocabulary, entry))
+        return entry
+
+    def _next_generation(self, vocabulary):
+        with self._lock:
+            if self.vocabulary is vocabulary:
+                self.vocabulary = Vocabulary()
+                self._cache.clear()
+                self.generations += 1
+
+    def matrix(self, books, max_df=0.5):
+        """
+        Returns the L2-normalized TF-IDF matrix of books (one row per book), with the
+        document frequencies taken over books, and the terms of its columns. Terms found
+        in more than a max_df fraction of at least MIN_BOOKS_FOR_MAX_DF books are dropped:
+        they say little about how similar two books are, but make nearly every pair
+        overlap and the product dense.
+        """
+        # Pinned for the whole graph, so its rows share one set of column ids even if
+        # another request starts a new generation meanwhile.
+        vocabulary = self.vocabulary
+        entries = [self.counts(book, vocabulary) for book in books]
+        indptr = np.zeros(len(entries) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids, _ in entries], out=indptr[1:])
+        indices = np.concatenate([ids for ids, _ in entries]) if entries else np.zeros(0, dtype=np.int32)
+        counts = np.concatenate([counts for _, counts in entries]) if entries else np.zeros(0, dtype=np.float32)
+        matrix = sp.csr_matrix((counts, indices, indptr), shape=(len(entries), len(vocabulary)))
+
+        document_frequency = np.bincount(indices, minlength=matrix.shape[1])
+        idf = np.log((1 + len(entries)) / (1 + document_frequency)).astype(np.float32) + 1
+        if len(entries) >= self.MIN_BOOKS_FOR_MAX_DF:
+            idf[document_frequency > max_df * len(entries)] = 0
+        # Sublinear term frequency, so a word repeated in a summary doesn't dominate.
+        matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices]
+        matrix.eliminate_zeros()
+        indptr = matrix.indptr
+        row_of = np.repeat(np.arange(len(entries)), np.diff(indptr))
+        norms = np.sqrt(np.bincount(row_of, weights=matrix.data ** 2, minlength=len(entries)))
+        matrix.data /= norms[row_of].astype(np.float32)
+        if len(vocabulary) > self.max_terms:
+            self._next_generation(vocabulary)
+        return matrix, vocabulary.terms
+
+    def stats(self):
+        return dict(self._cache.stats(), vocabulary=len(self.vocabulary), generations=self.generations)
+
+
+def top_k_pairs(matrix, k, min_similarity=0.1, start=0, batch_size=512):
+    """
+    Returns (i, j, similarity) arrays for the k most similar books of each row from start
+    on, with i < j, each pair once and at least min_similarity. Rows before start are only
+    paired with the rows after it.
+    """
+    n = matrix.shape[0]
+    transposed = matrix.T.tocsc()
+    rows, cols, values = [], [], []
+    for batch_start in range(start, n, batch_size):
+        batch_end = min(batch_start + batch_size, n)
+        similarities = (matrix[batch_start:batch_end] @ transposed).toarray()
+        batch_rows = np.arange(batch_end - batch_start)
+        # A book is always most similar to itself.
+        similarities[batch_rows, batch_start + batch_rows] = 0
+        kk = min(k, n - 1)
+        if kk <= 0:
+            break
+        neighbours = np.argpartition(-similarities, kk - 1, axis=1)[:, :kk]
+        scores = np.take_along_axis(similarities, neighbours, axis=1)
+        keep = scores >= min_similarity
+        rows.append(np.repeat(batch_start + batch_rows, kk).reshape(-1, kk)[keep])
+        cols.append(neighbours[keep])
+        values.append(scores[keep])
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float32)
+
+    i = np.concatenate(rows)
+    j = np.concatenate(cols)
+    first, second = np.minimum(i, j), np.maximum(i, j)
+    _, unique = np.unique(first * n + second, return_index=True)
+    return first[unique], second[unique], np.concatenate(values)[unique]
+
+
+def shared_top_terms(matrix, i, j, terms, count=3):
+    """
+    Returns, for each pair (i[x], j[x]), the count terms that contribute most to its
+    similarity.
+    """
+    contributions = matrix[i].multiply(matrix[j]).tocsr()
+    contributions.eliminate_zeros()
+    row_of = np.repeat(np.arange(contributions.shape[0]), np.diff(contributions.indptr))
+    order = np.lexsort((-contributions.data, row_of))
+    rank = np.arange(len(order)) - contributions.indptr[row_of[order]]
+    top = order[rank < count]
+    shared = [[] for _ in range(len(i))]
+    for row, column in zip(row_of[top].tolist(), contributions.indices[top].tolist()):
+        shared[row].append(terms[column])
+    return shared
@@ -0,0 +1,127 @@
+"""
+Checks the circuit breaker, hedging and timeouts of upstream.Upstream against calls
+slowed down with the benchmark stand-ins' Latency. Run from the gutget directory:
+
+    python testUpstream.py
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.standins import Latency
+from upstream import CircuitOpenError, Upstream, UpstreamTimeout
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} Error", response=response)
+
+
+def failing(status):
+    def fn(timeout):
+        raise http_error(status)
+    return fn
+
+
+def expect(error_type, fn, *args):
+    try:
+        fn(*args)
+    except error_type as e:
+        return e
+    raise AssertionError(f"expected {error_type.__name__}")
+
+
+# 5xx responses open the circuit, and it then fails fast with a retry hint.
+upstream = Upstream("breaker", failure_threshold=3, reset_timeout=0.2)
+for _ in range(3):
+    expect(requests.HTTPError, upstream.call, failing(503))
+error = expect(CircuitOpenError, upstream.call, lambda timeout: "ok")
+assert 0 < error.retry_after <= 0.2, error.retry_after
+print("5xx opens the circuit:", upstream.stats())
+
+# After reset_timeout a trial call is let through, and its success closes the circuit.
+time.sleep(0.25)
+assert upstream.call(lambda timeout: "ok") == "ok"
+assert upstream.breaker.state == "closed"
+print("trial call closes it:", upstream.breaker.state)
+
+# Client errors (a malformed query) are raised as they are and don't trip the breaker.
+upstream = Upstream("client errors", failure_threshold=3, reset_timeout=30)
+for _ in range(10):
+    expect(requests.HTTPError, upstream.call, failing(400))
+assert upstream.breaker.state == "closed" and upstream.failures == 0
+assert len(upstream.latencies) == 10
+print("4xx leaves it closed:", upstream.stats())
+
+# A slow tail is cut short by hedging once the latency window has enough samples.
+latency = Latency(ms=10, seed=1, tail_ms=500, tail_rate=0.02)
+
+
+def slow(timeout):
+    latency.sleep()
+    return "ok"
+
+
+for hedge in (False, True):
+    upstream = Upstream("hedging", min_timeout=0.2, max_timeout=2, hedge=hedge, min_samples=20)
+    latencies = []
+    for _ in range(300):
+        started = time.monotonic()
+        upstream.call(slow)
+        latencies.append(time.monotonic() - started)
+    slowest = max(latencies[50:])
+    print(f"hedge={hedge}: slowest call {slowest * 1000:.0f} ms, {upstream.stats()}")
+    if hedge:
+        assert upstream.hedges > 0 and slowest < 0.15, slowest
+    else:
+        assert upstream.hedges == 0 and slowest > 0.4, slowest
+
+# Calls slower than the adaptive timeout (3x p99, clamped) fail with UpstreamTimeout.
+upstream = Upstream("timeout", min_timeout=0.05, max_timeout=2, hedge=False, min_samples=20)
+fast = Latency(ms=5, seed=1)
+for _ in range(20):
+    upstream.call(lambda timeout: fast.sleep())
+assert upstream.timeout() < 0.1, upstream.timeout()
+expect(UpstreamTimeout, upstream.call, lambda timeout: time.sleep(0.3))
+print("slow call times out:", upstream.stats())
+
+# Waiting for a worker or a concurrency slot isn't upstream latency: a saturated pool in
+# front of a healthy upstream mustn't cause hedges, timeouts or an open circuit.
+healthy = Latency(ms=300, jitter=0.05, seed=1)
+
+
+def steady(timeout):
+    healthy.sleep()
+    return "ok"
+
+
+async def steady_async(timeout):
+    await asyncio.sleep(healthy.ms / 1000)
+    return "ok"
+
+
+upstream = Upstream("saturated", min_timeout=0.2, max_timeout=2, min_samples=20, failure_threshold=3)
+for _ in range(20):
+    upstream.call(steady)
+with ThreadPoolExecutor(max_workers=128) as clients:
+    results = list(clients.map(lambda _: upstream.call(steady), range(128)))
+assert results == ["ok"] * 128 and upstream.timeouts == 0 and upstream.breaker.state == "closed"
+assert upstream.hedges < 10, upstream.hedges
+print("saturated thread pool:", upstream.stats())
+
+
+async def saturate_async():
+    semaphore = asyncio.Semaphore(32)
+    for _ in range(20):
+        await upstream.call_async(steady_async, semaphore=semaphore)
+    return await asyncio.gather(*(upstream.call_async(steady_async, semaphore=semaphore) for _ in range(150)))
+
+
+upstream = Upstream("saturated async", min_timeout=0.2, max_timeout=2, min_samples=20, failure_threshold=3)
+assert asyncio.run(saturate_async()) == ["ok"] * 150
+assert upstream.timeouts == 0 and upstream.breaker.state == "closed"
+assert upstream.hedges < 10, upstream.hedges
+print("saturated semaphore:", upstream.stats())
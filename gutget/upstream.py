@@ -0,0 +1,343 @@
+"""
+Resilient calls to the upstream services (Gutendex and OpenAI).
+
+Upstream wraps each call with:
+
+- an adaptive timeout: a multiple of the recent p99 latency, clamped between min_timeout
+  and max_timeout (max_timeout until enough calls have been seen),
+- a hedged request: when the first attempt is still outstanding after the recent p95
+  latency, a duplicate is sent and whichever answers first wins,
+- a circuit breaker: after failure_threshold consecutive failures, calls fail fast with
+  CircuitOpenError for reset_timeout seconds, then a single trial call is let through.
+  Only timeouts, connection errors and 5xx/429 responses count as failures; other errors
+  (such as a 400 for a malformed query) are the caller's and are raised as they are.
+
+The wrapped function is called as fn(timeout, *args) and should use timeout for its own
+I/O, so attempts that lose a hedge or outlive the deadline don't linger.
+"""
+import asyncio
+import contextlib
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+
+class UpstreamError(Exception):
+    """
+    Raised by Upstream when a call isn't attempted or doesn't finish in time.
+    """
+
+
+class UpstreamTimeout(UpstreamError):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable, retry in {math.ceil(retry_after)}s")
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(error):
+    """
+    Returns True when error says the upstream is unhealthy rather than that the request
+    was bad: an error without an HTTP status (timeout, connection error, ...), a 5xx or a
+    429. Works with requests and httpx errors (error.response.status_code) and OpenAI
+    API errors (error.status_code).
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status >= 500 or status == 429
+
+
+class LatencyWindow:
+    """
+    Latencies of the most recent successful calls.
+    """
+
+    def __init__(self, size=256):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        """
+        Returns the q-th quantile (0 < q <= 1) of the window, or None when it is empty.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(math.ceil(q * len(samples)), len(samples)) - 1]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures. Once failure_threshold is reached the circuit opens and
+    allow() refuses calls for reset_timeout seconds. It then lets a single trial call
+    through (half-open), whose outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def retry_after(self):
+        return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def abandon(self):
+        """
+        Releases the half-open trial of a call that was cancelled before it finished.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.trips += 1
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class Upstream:
+    """
+    Adaptive timeouts, hedging and a circuit breaker for one upstream service. call()
+    runs attempts on a thread pool for synchronous code and call_async() runs them as
+    tasks on the event loop. Set hedge=False for calls too expensive to duplicate.
+    is_failure decides which errors count against the circuit breaker. Pass the breaker
+    of another Upstream to share it, for calls with different latencies to one service.
+    """
+
+    def __init__(self, name, min_timeout=1.0, max_timeout=30.0, timeout_multiplier=3.0, hedge=True,
+                 hedge_percentile=0.95, min_samples=20, failure_threshold=5, reset_timeout=30, max_workers=32,
+                 is_failure=is_upstream_failure, breaker=None):
+        self.name = name
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.is_failure = is_failure
+        self.latencies = LatencyWindow()
+        self.breaker = breaker or CircuitBreaker(failure_threshold, reset_timeout)
+        self.calls = 0
+        self.hedges = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.rejected = 0
+        self.max_workers = max_workers
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"upstream-{name}")
+
+    def timeout(self):
+        if len(self.latencies) < self.min_samples:
+            return self.max_timeout
+        p99 = self.latencies.percentile(0.99)
+        return min(max(p99 * self.timeout_multiplier, self.min_timeout), self.max_timeout)
+
+    def hedge_delay(self):
+        """
+        Returns how long to wait before sending a hedged request, or None not to hedge.
+        """
+        if not self.hedge or len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.percentile(self.hedge_percentile)
+
+    def _begin(self):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(self.name, self.breaker.retry_after())
+        self.calls += 1
+        return self.timeout(), self.hedge_delay()
+
+    def _succeed(self, elapsed):
+        self.latencies.record(elapsed)
+        self.breaker.record_success()
+
+    def _fail(self, error, timeout):
+        self.breaker.record_failure()
+        if error is None:
+            self.timeouts += 1
+            return UpstreamTimeout(f"{self.name} did not answer within {timeout:.2f}s")
+        self.failures += 1
+        return error
+
+    def _timed(self, fn, timeout, args, started=None):
+        """
+        Returns (result, client_error, elapsed). Errors that aren't upstream failures are
+        returned rather than raised, since the upstream answered. The start time is set on
+        the started future, if given, once a worker picks the attempt up.
+        """
+        begin = time.monotonic()
+        if started is not None:
+            started.set_result(begin)
+        try:
+            result = fn(timeout, *args)
+        except Exception as e:
+            if self.is_failure(e):
+                raise
+            return None, e, time.monotonic() - begin
+        return result, None, time.monotonic() - begin
+
+    def _submit(self, fn, timeout, args, started=None):
+        with self._lock:
+            self._in_use += 1
+        future = self._executor.submit(self._timed, fn, timeout, args, started)
+        future.add_done_callback(self._release_worker)
+        return future
+
+    def _release_worker(self, future):
+        with self._lock:
+            self._in_use -= 1
+
+    def call(self, fn, *args):
+        """
+        Calls fn(timeout, *args) on the thread pool. The deadline and the hedge delay are
+        measured from when the first attempt starts, so time spent waiting for a worker
+        isn't taken for upstream latency, and no hedge is sent while every worker is busy.
+        Attempts still queued when the call returns are cancelled; running ones end
+        within their own timeout.
+        """
+        timeout, hedge_delay = self._begin()
+        started = Future()
+        attempts = {self._submit(fn, timeout, args, started)}
+        error = None
+        try:
+            start = started.result()
+            deadline = start + timeout
+            hedge_at = start + hedge_delay if hedge_delay is not None else None
+            while attempts:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                wake_at = min(hedge_at, deadline) if hedge_at is not None else deadline
+                done, attempts = wait(attempts, timeout=wake_at - now, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result, client_error, elapsed = future.result()
+                    except Exception as e:
+                        error = e
+                    else:
+                        self._succeed(elapsed)
+                        if client_error is not None:
+                            raise client_error
+                        return result
+                if attempts and hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if self._in_use < self.max_workers:
+                        self.hedges += 1
+                        attempts.add(self._submit(fn, timeout, args))
+        finally:
+            for future in attempts:
+                future.cancel()
+        raise self._fail(None if attempts else error, timeout)
+
+    async def _timed_async(self, fn, timeout, args, semaphore, started=None):
+        async with semaphore or contextlib.nullcontext():
+            begin = time.monotonic()
+            if started is not None:
+                started.set_result(begin)
+            try:
+                result = await fn(timeout, *args)
+            except Exception as e:
+                if self.is_failure(e):
+                    raise
+                return None, e, time.monotonic() - begin
+            return result, None, time.monotonic() - begin
+
+    async def call_async(self, fn, *args, semaphore=None):
+        """
+        Awaits fn(timeout, *args). Each attempt holds semaphore, when given, while it runs.
+        As in call(), the clock starts once the first attempt holds it, and no hedge is
+        sent while it is exhausted.
+        """
+        timeout, hedge_delay = self._begin()
+        started = asyncio.get_running_loop().create_future()
+        attempts = {asyncio.ensure_future(self._timed_async(fn, timeout, args, semaphore, started))}
+        error = None
+        try:
+            start = await started
+            deadline = start + timeout
+            hedge_at = start + hedge_delay if hedge_delay is not None else None
+            while attempts:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                wake_at = min(hedge_at, deadline) if hedge_at is not None else deadline
+                done, attempts = await asyncio.wait(attempts, timeout=wake_at - now, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        result, client_error, elapsed = task.result()
+                    except Exception as e:
+                        error = e
+                    else:
+                        self._succeed(elapsed)
+                        if client_error is not None:
+                            raise client_error
+                        return result
+                if attempts and hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if semaphore is None or not semaphore.locked():
+                        self.hedges += 1
+                        attempts.add(asyncio.ensure_future(self._timed_async(fn, timeout, args, semaphore)))
+        except asyncio.CancelledError:
+            self.breaker.abandon()
+            raise
+        finally:
+            for task in attempts:
+                task.cancel()
+        raise self._fail(None if attempts else error, timeout)
+
+    def stats(self):
+        percentiles = {f"p{round(q * 100)}": self.latencies.percentile(q) for q in (0.5, 0.95, 0.99)}
+        hedge_delay = self.hedge_delay()
+        return dict(
+            {name: round(value, 4) if value is not None else None for name, value in percentiles.items()},
+            state=self.breaker.state,
+            timeout=round(self.timeout(), 3),
+            hedge_delay=round(hedge_delay, 4) if hedge_delay is not None else None,
+            calls=self.calls,
+            hedges=self.hedges,
+            timeouts=self.timeouts,
+            failures=self.failures,
+            rejected=self.rejected,
+            trips=self.breaker.trips
+        )
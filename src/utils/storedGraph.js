@@ -0,0 +1,15 @@
+import axios from 'axios'
+
+// Gutenberg IDs of the books already in the stored graph. Sent to /query_books_graph as
+// existing_ids so the backend only returns the new books and the lines that link them.
+export const getStoredGutindexIds = async () => {
+  try {
+    const res = await axios.get('http://localhost:2600/books')
+    return (res.data?.nodes || [])
+      .map((node) => node?.data?.gutindex_id)
+      .filter((id) => id !== undefined && id !== null)
+  } catch (error) {
+    console.error('Failed to read the stored graph:', error)
+    return []
+  }
+}